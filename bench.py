@@ -0,0 +1,309 @@
+import os
+import sys
+import json
+import tracemalloc
+from random import Random
+from time import perf_counter
+from timeit import repeat
+
+import node_config
+from packet import *
+from node import Node, Route, Neighbor, PassiveAck, BadNode, QueuedData, RecentRREQ, RoutingTable
+from engine import Engine
+from graph import Graph
+from scheduler import Scheduler
+from spatial import Vector, np as spatial_np
+
+
+# benchmark suite for the protocol and simulator hot paths
+#
+#   python3 bench.py [name ...]         run all or some, compare to baseline
+#   python3 bench.py [name ...] --save  also store results as the baseline
+#
+# numbers are per machine, keep the baseline from the same box you compare on
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+
+# { 'section/name' : value }
+RESULTS = {}
+BASELINE = {}
+SECTION = ''
+
+def section(title):
+    global SECTION
+    SECTION = title.lower()
+    print(f' == {title} == ')
+
+# time fn over n calls, best of r, return microseconds per call
+def bench(fn, n=1000, r=5):
+    return min(repeat(fn, number=n, repeat=r)) / n * 1e6
+
+# speedup vs base in the same run, change vs stored baseline
+def report(name, value, base=None, unit='us'):
+    key = f'{SECTION}/{name}'
+    RESULTS[key] = value
+    line = f'{name:<40}{value:>12.2f} {unit:<3}'
+    line += f'{base/value:>8.1f}x' if base else ' '*9
+    old = BASELINE.get(key)
+    if old:
+        line += f'{(value/old - 1)*100:>+9.1f}% vs baseline'
+    print(line)
+
+
+def bench_checksum():
+    section('FLETCHER-16')
+    for size in [24, 64, PACKET_LEN]:
+        data = os.urandom(size)
+        base = bench(lambda: compute_fletcher_16_ref(data))
+        report(f'ref {size}B', base)
+        report(f'blocks {size}B', bench(lambda: fletcher_16_blocks(data)), base)
+        report(f'fast {size}B', bench(lambda: compute_fletcher_16(data)), base)
+
+    frames = [os.urandom(PACKET_LEN) for _ in range(256)]
+    base = bench(lambda: [compute_fletcher_16_ref(f) for f in frames], 50)
+    report('ref x256 frames', base)
+    report('batch x256 frames', bench(lambda: fletcher_16_batch(frames), 50), base)
+    raws = [Packet().construct(AODVType.DATA, DUMMY_ADDR, payload=os.urandom(PAYLOAD_MAX_LEN)) for _ in range(256)]
+    report('verify_batch x256 frames', bench(lambda: verify_batch(raws), 50), base)
+    if np is None:
+        print('(numpy not installed, batch is the per frame fallback)')
+
+
+def bench_codec():
+    section('CODEC')
+    r = RREQ()
+    r.set_flags(gratuitous=1, unknown=1)
+    r.set_data(dest_addr=b'\x13'*8, orig_addr=DUMMY_ADDR, dest_seq=0, orig_seq=32, rreq_id=5)
+    p = Packet()
+    raw = p.construct(AODVType.RREQ, DUMMY_ADDR, payload=r.pack())
+    report('Packet.pack rreq', bench(p.pack, 10000))
+    report('Packet(raw) rreq', bench(lambda: Packet(raw), 10000))
+    report('RREQ(payload)', bench(lambda: RREQ(p.payload), 10000))
+    report('Packet(raw) x32 receivers', bench(lambda: [Packet(raw) for _ in range(32)], 1000))
+    d = DATAGRAM()
+    d.set_data(dest_addr=b'\x13'*8, orig_addr=DUMMY_ADDR, orig_seq=1, data='x'*PAYLOAD_MAX_LEN)
+    p = Packet()
+    raw = p.construct(AODVType.DATA, DUMMY_ADDR, payload=d.pack())
+    report(f'Packet.pack data {len(raw)}B', bench(p.pack, 10000))
+    report(f'Packet(raw) data {len(raw)}B', bench(lambda: Packet(raw), 10000))
+    report('DATAGRAM(payload)', bench(lambda: DATAGRAM(p.payload), 10000))
+
+
+def bench_messages():
+    section('MESSAGES')
+    rreq = RREQ()
+    rreq.set_flags(gratuitous=1, unknown=1)
+    rreq.set_data(dest_addr=b'\x13'*8, orig_addr=DUMMY_ADDR, dest_seq=0, orig_seq=32, rreq_id=5)
+    rrep = RREP()
+    rrep.set_data(dest_addr=b'\x13'*8, orig_addr=DUMMY_ADDR, dest_seq=32, hop_count=3, lifetime=300)
+    rerr = RERR()
+    rerr.set_data(bad_addr=b'\x13'*8, bad_seq=4, addr_list=[bytes([i])*8 for i in range(8)], seq_list=list(range(8)), no_delete=False)
+    hello = HELLO()
+    hello.set_data(dest_addr=DUMMY_ADDR, orig_addr=DUMMY_ADDR, dest_seq=7, hop_count=0, lifetime=2)
+    ack = ACK()
+    ack.set_data(orig_seq=9, data_seq=3)
+    data = DATAGRAM()
+    data.set_data(dest_addr=b'\x13'*8, orig_addr=DUMMY_ADDR, orig_seq=1, data='x'*64)
+    for name, msg in [('RREQ', rreq), ('RREP', rrep), ('RERR x8', rerr), ('HELLO', hello), ('ACK', ack), ('DATAGRAM 64B', data)]:
+        raw = msg.pack()
+        cls = type(msg)
+        report(f'{name} pack', bench(msg.pack, 10000))
+        report(f'{name} unpack', bench(lambda: cls(raw), 10000))
+    p = Packet()
+    raw = p.construct(AODVType.RREQ, DUMMY_ADDR, payload=rreq.pack())
+    report('Packet.deconstruct rreq', bench(lambda: p.deconstruct(raw), 10000))
+
+
+# random 8 byte addresses, repeatable
+def _addrs(n, seed=0):
+    r = Random(seed)
+    return [r.randbytes(8) for _ in range(n)]
+
+def bench_routing():
+    section('ROUTING')
+    for n in [100, 10000]:
+        addrs = _addrs(n)
+        def fill():
+            rt = RoutingTable(DUMMY_ADDR, Scheduler().time)
+            for i, a in enumerate(addrs):
+                rt.add_update(a, next_hop=DUMMY_ADDR, seq_num=1, hops=3, seq_valid=True)
+            return rt
+        report(f'add_update new x{n}', bench(fill, 1, 3) / n)
+        rt = fill()
+        seq = [2]
+        def refresh():
+            seq[0] += 1
+            for a in addrs:
+                rt.add_update(a, next_hop=DUMMY_ADDR, seq_num=seq[0], hops=3, seq_valid=True)
+        report(f'add_update existing x{n}', bench(refresh, 1, 3) / n)
+
+    # idle node with big tables, should not depend on table size
+    for n in [100, 10000]:
+        clock = Scheduler()
+        node = Node(DUMMY_ADDR, clock=clock.time)
+        for a in _addrs(n):
+            node.routing_table.add_update(a, next_hop=a, seq_num=1, hops=2, seq_valid=True)
+        def tick():
+            clock.now += 1/60
+            node.update()
+        report(f'Node.update {n} routes', bench(tick, 1000))
+
+
+# nodes on a lattice, spacing 0.7 of range so neighbors are 1 hop apart
+def _grid_engine(n, seed=0, config=None):
+    e = Engine(seed=seed, config=config)
+    e.settings.num_nodes = n
+    side = int(n ** 0.5 + 0.999)
+    step = int(e.settings.range * 0.7)
+    for i, name in enumerate(e.node_names()):
+        e.add_node(e.random.randbytes(8), name, (30 + (i % side) * step, 30 + (i // side) * step))
+    return e
+
+# same node density as the lattice, random positions
+def _random_engine(n, seed=0, config=None):
+    e = Engine(seed=seed, config=config)
+    e.settings.num_nodes = n
+    side = int(n ** 0.5 + 0.999)
+    w = side * int(e.settings.range * 0.7)
+    for name in e.node_names():
+        e.add_node(e.random.randbytes(8), name, (e.random.randint(30, w), e.random.randint(30, w)))
+    return e
+
+# with the defaults reverse routes get no lifetime past 6 hops
+# (2*NET_TRAVERSAL_TIME - 2*hops*NODE_TRAVERSAL_TIME), so give the
+# flood room for DISCOVERY_HOPS. full floods, no ring timeouts in the numbers
+DISCOVERY_HOPS = 16
+DISCOVERY_CONFIG = node_config.make(NET_DIAMETER=20, NET_TRAVERSAL_TIME=20, EXPANDING_RING=False)
+
+# first node to the node furthest away within DISCOVERY_HOPS, step until the
+# source has a valid route. returns (found, ticks, hops)
+def _discover(e, max_ticks=2000):
+    # a signal dies once it grows past range, the last ring before that isn't
+    # always covered. count hops over what every signal surely reaches
+    g = Graph()
+    g.rebuild(e.nodes, e.settings.range - e.settings.speed)
+    src = e.nodes[0]
+    hops = g.hop_counts(src.addr)
+    dest = max((a for a in hops if hops[a] <= DISCOVERY_HOPS), key=lambda a: (hops[a], a))
+    src.aodv.send(dest, 'x')
+    start = e.ticks
+    while e.ticks - start < max_ticks:
+        e.step()
+        r = src.aodv.routing_table[dest]
+        if r and r.valid():
+            return True, e.ticks - start, hops[dest]
+    return False, e.ticks - start, hops[dest]
+
+# runs that find no route are skipped, timing a give up is no baseline
+def bench_discovery():
+    section('DISCOVERY')
+    for topo, make in [('grid', _grid_engine), ('random', _random_engine)]:
+        for n in [10, 100, 1000]:
+            found = []
+            def run():
+                found.append(_discover(make(n, config=DISCOVERY_CONFIG)))
+            us = bench(run, 1, 3 if n < 1000 else 1)
+            if all(ok for ok, _, _ in found):
+                _, ticks, hops = found[-1]
+                report(f'{topo} {n} nodes, {hops} hops', us / 1000, unit='ms')
+            else:
+                _, ticks, hops = next(f for f in found if not f[0])
+                print(f'{topo} {n} nodes, {hops} hops: no route after {ticks} ticks, skipped')
+
+
+# many signals in flight at once, ie a flood
+def _flood(medium, n=500):
+    e = Engine(seed=0, medium=medium)
+    e.reset_nodes(num_nodes=n)
+    raw = Packet().construct(AODVType.HELLO, DUMMY_ADDR)
+    # indexes built up front, a dirty index would reset what's covered
+    e.grid.rebuild(e.nodes)
+    e.grid_dirty = False
+    e.update_graph()
+    for node in e.nodes:
+        s = e.emit_signal(node, raw)
+        s.radius = e.random.randint(1, e.settings.range)
+        s.covered = max(0, s.radius - e.settings.speed)
+    return e
+
+def bench_propagation():
+    section('PROPAGATION')
+    e = _flood('grid')
+    grid = e.grid
+    base = bench(lambda: list(grid.reached(e.signals)), 10)
+    report('grid reached, 500 signals', base)
+    g = e.update_graph()
+    report('graph reached, 500 signals', bench(lambda: list(g.reached(e.signals)), 10), base)
+    if spatial_np is not None:
+        v = Vector()
+        v.rebuild(e.nodes)
+        report('vector reached, 500 signals', bench(lambda: list(v.reached(e.signals)), 10), base)
+
+    # whole step, delivering into the nodes. fresh flood every time
+    times = []
+    for _ in range(3):
+        e = _flood('grid')
+        start = perf_counter()
+        e.detect_collisions()
+        times.append(perf_counter() - start)
+    report('detect_collisions, 500 signals', min(times) * 1e6)
+
+
+# allocated bytes per object made by fn, averaged over n
+def bytes_per(fn, n=10000):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    keep = [fn(i) for i in range(n)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # minus the list holding them
+    return (after - before - sys.getsizeof(keep)) / n
+
+def bench_memory():
+    section('MEMORY')
+    rreq = RREQ()
+    rreq.set_data(dest_addr=b'\x13'*8, orig_addr=DUMMY_ADDR, dest_seq=0, orig_seq=1, rreq_id=1)
+    sizes = { 'Route' : lambda i: Route(next_hop=DUMMY_ADDR, seq_num=i, hops=3, seq_valid=True, lifetime=3000),
+              'Neighbor' : lambda i: Neighbor(rssi=-40, snr=9),
+              'PassiveAck' : lambda i: PassiveAck(DUMMY_ADDR, i),
+              'BadNode' : lambda i: BadNode(DUMMY_ADDR),
+              'QueuedData' : lambda i: QueuedData(DUMMY_ADDR, 'hello'),
+              'RecentRREQ' : lambda i: RecentRREQ(rreq) }
+    for name, fn in sizes.items():
+        report(name, bytes_per(fn), unit='B')
+
+    # whole routing table entry: route, table slot and timer heap entry
+    n = 10000
+    rt = RoutingTable(DUMMY_ADDR)
+    addrs = [i.to_bytes(8, 'big') for i in range(n)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for i, a in enumerate(addrs):
+        rt.add_update(a, next_hop=DUMMY_ADDR, seq_num=i, hops=3, seq_valid=True)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    report('routing table entry', (after-before)/n, unit='B')
+
+
+if __name__ == '__main__':
+    benches = { 'checksum' : bench_checksum,
+                'codec' : bench_codec,
+                'messages' : bench_messages,
+                'routing' : bench_routing,
+                'discovery' : bench_discovery,
+                'propagation' : bench_propagation,
+                'memory' : bench_memory }
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    save = '--save' in sys.argv
+
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as f:
+            BASELINE = json.load(f)
+    for name in args or benches.keys():
+        benches[name]()
+
+    if save:
+        BASELINE.update(RESULTS)
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump(BASELINE, f, indent=1, sort_keys=True)
+        print(f'saved {len(RESULTS)} results to {BASELINE_FILE}')
@@ -0,0 +1,173 @@
+import sys
+from struct import Struct
+
+from packet import AODVType, HEADER_LEN
+
+
+# record every frame that goes over the air to a compact binary file.
+#
+#   rec = Recorder('run.cap')
+#   rec.attach(engine)
+#   engine.run_for(60)
+#   rec.close()
+#
+#   for r in read('run.cap'): ...
+#   to_pcap('run.cap', 'run.pcap')
+#
+# file: MAGIC, then records. each record is a fixed header, then `length`
+# bytes of frame:
+#
+#   kind    B   TX (frame sent) or RX (frame reached a node)
+#   time    d   virtual seconds
+#   addr    8s  sender for TX, receiver for RX
+#   ref     Q   RX: file offset of the TX record of that frame, TX: 0
+#   length  H   raw frame length, 0 for RX (the frame is in its TX record)
+#
+# records are only ever appended, buffered in memory and written in bulk.
+
+MAGIC = b'AODVCAP\x01'
+RECORD = Struct('>Bd8sQH')
+TX = 1
+RX = 2
+
+# bytes buffered before a write
+BUFFER_SIZE = 1 << 16
+
+
+class Record:
+    __slots__ = ('offset', 'kind', 'time', 'addr', 'ref', 'raw')
+    def __repr__(self):
+        return f'<{"TX" if self.kind == TX else "RX"} t={self.time:.3f} addr={self.addr} ref={self.ref} len={len(self.raw)}>'
+    def __init__(self, offset, kind, time, addr, ref, raw):
+        self.offset = offset
+        self.kind = kind
+        self.time = time
+        self.addr = addr
+        self.ref = ref
+        self.raw = raw
+    def aodvtype(self):
+        if len(self.raw) < HEADER_LEN:
+            return AODVType.UNKNOWN
+        return self.raw[16]
+
+
+class Recorder:
+    def __init__(self, path, buffer_size=BUFFER_SIZE):
+        self.f = open(path, 'wb')
+        self.buf = bytearray(MAGIC)
+        self.buffer_size = buffer_size
+        # file offset of the end of buf
+        self.offset = len(MAGIC)
+        self.records = 0
+
+    def _append(self, kind, t, addr, ref, raw=b''):
+        start = self.offset
+        self.buf += RECORD.pack(kind, t, addr, ref, len(raw))
+        self.buf += raw
+        self.offset += RECORD.size + len(raw)
+        self.records += 1
+        if len(self.buf) >= self.buffer_size:
+            self.flush()
+        return start
+
+    # frame sent, returns its record offset
+    def tx(self, t, sender, raw):
+        return self._append(TX, t, sender, 0, raw)
+
+    # frame from the TX record at ref reached receiver
+    def rx(self, t, receiver, ref):
+        return self._append(RX, t, receiver, ref)
+
+    def flush(self):
+        if self.buf:
+            self.f.write(self.buf)
+            self.buf = bytearray()
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+    # record everything an engine sends and delivers
+    def attach(self, engine):
+        engine.on_emit.append(self._on_emit)
+        engine.on_deliver.append(self._on_deliver)
+        return self
+
+    def _on_emit(self, engine, node, signal):
+        signal.capture_ref = self.tx(engine.now(), node.addr, bytes(signal.payload))
+
+    def _on_deliver(self, engine, node, signal):
+        ref = getattr(signal, 'capture_ref', None)
+        if ref is not None:
+            self.rx(engine.now(), node.addr, ref)
+
+
+# stream records from a capture file, one at a time
+def read(path, chunk=BUFFER_SIZE):
+    with open(path, 'rb', buffering=chunk) as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'not a capture file: {path}')
+        offset = len(MAGIC)
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return
+            kind, t, addr, ref, length = RECORD.unpack(head)
+            raw = f.read(length) if length else b''
+            yield Record(offset, kind, t, addr, ref, raw)
+            offset += RECORD.size + length
+
+
+# pcap, one packet per sent frame, timestamped with virtual time.
+# link type USER0: wireshark shows raw bytes unless told how to decode
+PCAP_HEADER = Struct('<IHHiIII')
+PCAP_RECORD = Struct('<IIII')
+PCAP_MAGIC = 0xa1b2c3d4
+LINKTYPE_USER0 = 147
+
+def to_pcap(path, pcap_path):
+    n = 0
+    with open(pcap_path, 'wb') as out:
+        out.write(PCAP_HEADER.pack(PCAP_MAGIC, 2, 4, 0, 0, 65535, LINKTYPE_USER0))
+        for r in read(path):
+            if r.kind != TX:
+                continue
+            sec = int(r.time)
+            usec = int(round((r.time - sec) * 1e6))
+            if usec >= 1000000:
+                sec, usec = sec + 1, usec - 1000000
+            out.write(PCAP_RECORD.pack(sec, usec, len(r.raw), len(r.raw)))
+            out.write(r.raw)
+            n += 1
+    return n
+
+
+if __name__ == '__main__':
+    usage = ('usage: python3 capture.py record out.cap [num_nodes] [seconds]\n'
+             '       python3 capture.py dump in.cap\n'
+             '       python3 capture.py pcap in.cap out.pcap')
+    if len(sys.argv) < 3:
+        sys.exit(usage)
+    cmd, path = sys.argv[1], sys.argv[2]
+
+    if cmd == 'record':
+        import time
+        from engine import Engine
+        num_nodes = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+        seconds = float(sys.argv[4]) if len(sys.argv) > 4 else 10
+        e = Engine(seed=0)
+        e.reset_nodes(num_nodes=num_nodes)
+        rec = Recorder(path).attach(e)
+        names = e.node_names()
+        e.ping(names[0], names[1])
+        start = time.time()
+        e.run_for(seconds)
+        rec.close()
+        print(f'{rec.records} records, {rec.offset} bytes in {time.time()-start:.2f}s')
+    elif cmd == 'dump':
+        for r in read(path):
+            print(r)
+    elif cmd == 'pcap':
+        print(f'{to_pcap(path, sys.argv[3])} frames written')
+    else:
+        sys.exit(usage)
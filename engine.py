@@ -0,0 +1,354 @@
+import time
+from itertools import chain
+from random import Random
+
+from node import Node as AODVNode
+import node_config
+from metrics import Metrics, aggregate
+from packet import AODVType, HEADER_LEN, Frame
+from scheduler import Scheduler, wall_clock
+from spatial import make_index
+from graph import Graph
+import sim_config as cfg
+
+
+# headless simulation engine. no pygame in here, the gui in main.py is just
+# an optional viewer on top of this. use it directly to run big scenarios
+# as fast as the cpu allows:
+#
+#   e = Engine(seed=1)
+#   e.reset_nodes(num_nodes=500)
+#   e.ping('john', 'morgan')
+#   e.run(ticks=1000)
+#
+# time is virtual: every tick advances the scheduler clock by dt, node
+# timers run on that clock, so runs are deterministic for a given seed and
+# don't wait for the wall clock.
+
+
+# engine settings. the gui extends these with its own stuff
+class Settings:
+    def __getitem__(self, key):
+        return self.__dict__.get(key, None)
+    def __setitem__(self, key, val):
+        if key in self.__dict__.keys():
+            self.__setattr__(key, val)
+    def __init__(self):
+        self.default()
+    def default(self):
+        self.paused = False
+        self.num_nodes = len(cfg.NODE_NAMES)
+        self.range = cfg.DEFAULT_RANGE
+        self.speed = cfg.DEFAULT_SPEED
+
+
+# node on the radio medium, wraps the aodv state machine
+class RadioNode:
+    def __init__(self, addr, nickname, position, logger=None, on_change=None, clock=wall_clock, config=node_config, metrics=None):
+        self.addr = addr
+        self.nickname = nickname
+        self._position = position
+        self.aodv = AODVNode(node_addr=addr, nickname=nickname, logger=logger, clock=clock, config=config, metrics=metrics)
+        self.inbox = []
+        self.online = True
+        # called when position or online state changes
+        self.on_change = on_change
+
+    @property
+    def position(self):
+        return self._position
+    @position.setter
+    def position(self, position):
+        self._position = position
+        if self.on_change:
+            self.on_change(self)
+
+    def toggle_online(self):
+        self.online = not self.online
+        if self.on_change:
+            self.on_change(self)
+
+    # step the aodv node, return outgoing raw packet if any
+    def update(self):
+        raw = self.aodv.update()
+        rx = self.aodv.pop_rx()
+        if rx:
+            self.inbox.append(rx)
+        return raw
+
+    # more outgoing packets this tick, up to TX_BUDGET
+    def pop_tx(self):
+        return self.aodv.pop_tx()
+
+
+# expanding signal ring
+class Transmission:
+    def __init__(self, src:RadioNode, payload:bytes, speed:int, range:int):
+        self.src_addr = src.addr
+        self.payload = payload
+        # decoded once, shared by all receivers
+        self.frame = Frame(payload)
+        self.position = src.position
+        self.speed = speed
+        self.range = range
+        self.radius = 1
+        # radius already checked for receivers
+        self.covered = 0
+        self.collided = set()
+        self.alive = True
+        if len(payload) < HEADER_LEN:
+            self.aodvtype = AODVType.UNKNOWN
+        else:
+            self.aodvtype = payload[16]
+
+    def update(self):
+        self.radius += self.speed
+        if self.radius > self.range:
+            self.alive = False
+
+
+class Engine:
+    def __init__(self, settings=None, seed=None, logger_factory=None, dt=1/cfg.FPS, medium=None, config=None, metrics=True):
+        self.settings = settings if settings else Settings()
+        self.random = Random(seed)
+        # called with nickname, returns logger for that node
+        self.logger_factory = logger_factory
+        # aodv settings for every node, node_config.make() for per run values
+        self.config = config if config else node_config
+        # per node metrics.Metrics, off = no-op counters
+        self.metrics = metrics
+
+        # hook(engine, node, signal) lists: frame sent, frame reached a node
+        self.on_emit = []
+        self.on_deliver = []
+
+        # virtual time, seconds per tick
+        self.scheduler = Scheduler()
+        self.dt = dt
+
+        self.nodes = []
+        self.signals = []
+        self.name2addr = {}
+        self.addr2name = {}
+        self.name2node = {}
+        self.ticks = 0
+
+        # spatial index over node positions, rebuilt when nodes move.
+        # medium: 'grid' or 'vector', see spatial.py
+        self.grid = make_index(medium)
+        self.grid_dirty = True
+
+        # connectivity graph, signals sent from a sender's current position
+        # use it to find receivers, the rest go through the index above
+        self.graph = Graph()
+        self.use_graph = cfg.USE_GRAPH
+
+    def emit_signal(self, node:RadioNode, payload:bytes):
+        s = Transmission(node, payload, self.settings.speed, self.settings.range)
+        self.signals.append(s)
+        for hook in self.on_emit:
+            hook(self, node, s)
+        return s
+
+    # node moved or went on/offline
+    def _node_changed(self, node):
+        self.grid_dirty = True
+        self.graph.move(node)
+
+    # rebuild graph on reset or range change (slider)
+    def update_graph(self):
+        if self.graph.dirty or self.graph.range != self.settings.range:
+            self.graph.rebuild(self.nodes, self.settings.range)
+        return self.graph
+
+    # shortest path hops between two nodes by name, None if unreachable
+    def hops(self, sender:str, recver:str):
+        return self.update_graph().hops(self.name2addr[sender], self.name2addr[recver])
+
+    def detect_collisions(self):
+        # nodes moved, rebuild index and recheck whole signal disks
+        if self.grid_dirty:
+            self.grid.rebuild(self.nodes)
+            self.grid_dirty = False
+            for signal in self.signals:
+                signal.covered = 0
+
+        if self.use_graph:
+            self.update_graph()
+            graph = [s for s in self.signals if self.graph.covers(s)]
+            other = [s for s in self.signals if not self.graph.covers(s)]
+            reached = chain(self.graph.reached(graph), self.grid.reached(other))
+        else:
+            reached = self.grid.reached(self.signals)
+
+        # only test the ring newly covered since last tick
+        for signal, node in reached:
+            if node.online and not signal.src_addr == node.addr:
+                if not node.addr in signal.collided:
+                    signal.collided.add(node.addr)
+                    for hook in self.on_deliver:
+                        hook(self, node, signal)
+                    self.deliver(node, signal)
+        for signal in self.signals:
+            signal.covered = signal.radius
+
+    # hand a signal to a receiving node
+    def deliver(self, node, signal):
+        node.aodv.on_recv(signal.frame)
+
+    # update aodv on online nodes, emit what they send
+    def update_nodes(self):
+        for node in self.nodes:
+            if node.online:
+                raw = node.update()
+                while raw:
+                    self.emit_signal(node, raw)
+                    raw = node.pop_tx()
+
+    # (all online nodes idle, earliest node timer deadline or None)
+    def nodes_idle(self):
+        due = None
+        for node in self.nodes:
+            if node.online:
+                if not node.aodv.idle():
+                    return False, None
+                d = node.aodv.next_deadline()
+                if d is not None and (due is None or d < due):
+                    due = d
+        return True, due
+
+    # generate random nodes
+    def reset_nodes(self, num_nodes=None):
+        if num_nodes:
+            self.settings.num_nodes = num_nodes
+        self.name2addr = {}
+        self.addr2name = {}
+        self.name2node = {}
+        self.nodes = []
+        self.signals = []
+        self.ticks = 0
+        self.scheduler = Scheduler()
+        self.grid_dirty = True
+        self.graph.dirty = True
+        for n in self.node_names():
+            x = self.random.randint(cfg.SIM_X_MARGIN, cfg.SIM_WIDTH - cfg.SIM_X_MARGIN)
+            y = self.random.randint(cfg.SIM_Y_MARGIN, cfg.SIM_HEIGHT - cfg.SIM_Y_MARGIN)
+            addr = self.random.randbytes(8)
+            self.add_node(addr, n, (x,y))
+
+    def add_node(self, addr, nickname, position):
+        logger = self.logger_factory(nickname) if self.logger_factory else None
+        m = Metrics() if self.metrics else None
+        node = RadioNode(addr, nickname, position, logger, self._node_changed, self.scheduler.time, self.config, m)
+        self.nodes.append(node)
+        self.grid_dirty = True
+        self.graph.dirty = True
+        self.name2addr[nickname] = addr
+        self.addr2name[addr] = nickname
+        self.name2node[nickname] = node
+        return node
+
+    # node names, numbered once the nickname list runs out
+    def node_names(self):
+        names = cfg.NODE_NAMES
+        out = names[:self.settings.num_nodes]
+        i = len(names)
+        while len(out) < self.settings.num_nodes:
+            out.append(f'{names[i % len(names)]}{i // len(names)}')
+            i += 1
+        return out
+
+    def ping(self, sender:str, recver:str):
+        self.name2node[sender].aodv.ping(self.name2addr[recver])
+
+    def send(self, sender:str, recver:str, data:str):
+        self.name2node[sender].aodv.send(self.name2addr[recver], data)
+
+    # network wide metrics, all node snapshots merged
+    def snapshot(self):
+        return aggregate(n.aodv.metrics.snapshot() for n in self.nodes)
+
+    # current virtual time, seconds
+    def now(self):
+        return self.scheduler.now
+
+    # schedule a callable at virtual time t, ie scripted pings
+    def at(self, t, event):
+        self.scheduler.at(t, event)
+
+    # advance the whole simulation by one tick
+    def step(self):
+        # move the clock, run any events due
+        self.scheduler.run_until(self.scheduler.now + self.dt)
+
+        # grow signals, drop finished ones
+        for s in self.signals:
+            s.update()
+        self.signals = [s for s in self.signals if s.alive]
+
+        self.update_nodes()
+        self.detect_collisions()
+        self.ticks += 1
+
+    # fast forward over ticks where nothing can happen: no signals in
+    # flight, every node idle and no node timer or scheduled event due.
+    # same clock arithmetic as step() so results don't change
+    def _skip_idle(self, end_tick=None, end_time=None):
+        if self.signals:
+            return
+        idle, d = self.nodes_idle()
+        if not idle:
+            return
+        due = self.scheduler.peek()
+        if d is not None and (due is None or d < due):
+            due = d
+        sched = self.scheduler
+        while due is None or sched.now + self.dt < due:
+            if end_tick is not None and self.ticks >= end_tick:
+                break
+            if end_time is not None and sched.now + self.dt > end_time:
+                break
+            sched.now += self.dt
+            self.ticks += 1
+
+    def run(self, ticks:int, skip_idle=True):
+        end = self.ticks + ticks
+        while self.ticks < end:
+            if skip_idle:
+                self._skip_idle(end_tick=end)
+                if self.ticks >= end:
+                    break
+            self.step()
+
+    # run for a span of virtual time
+    def run_for(self, seconds:float, skip_idle=True):
+        end = self.scheduler.now + seconds
+        while self.scheduler.now + self.dt <= end:
+            if skip_idle:
+                self._skip_idle(end_time=end)
+                if self.scheduler.now + self.dt > end:
+                    break
+            self.step()
+
+
+if __name__ == '__main__':
+    import sys
+
+    num_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    medium = sys.argv[3] if len(sys.argv) > 3 else None
+
+    e = Engine(seed=0, medium=medium)
+    e.reset_nodes(num_nodes=num_nodes)
+    names = e.node_names()
+    e.ping(names[0], names[1])
+
+    start = time.time()
+    e.run_for(seconds)
+    elapsed = time.time() - start
+    print(f'{num_nodes} nodes ({type(e.grid).__name__.lower()}), {seconds}s virtual ({e.ticks} ticks) in {elapsed:.2f}s wall ({e.ticks/elapsed:.1f} ticks/s)')
+    print(f'inbox: {sum(n.aodv.rx_processed for n in e.nodes)} processed, {sum(n.aodv.rx_dropped for n in e.nodes)} dropped')
+    m = e.snapshot()
+    print(f'metrics: {m.get("tx_bytes", 0)} bytes on air, {m.get("fwd", 0)} forwarded, {m.get("discovery_done", 0)}/{m.get("discovery_start", 0)} discoveries')
+    rr = [n.aodv.recent_rreqs for n in e.nodes]
+    print(f'recent rreqs: {sum(r.hits for r in rr)} hits, {sum(r.misses for r in rr)} misses, {sum(r.expired for r in rr)} expired, {sum(r.evictions for r in rr)} evicted')
@@ -0,0 +1,111 @@
+from bisect import bisect_left
+from collections import deque
+
+from spatial import Grid
+
+
+# connectivity graph cache: who is within range of who.
+# nodes only move on reset or while dragged, so keep adjacency sets keyed
+# by address and only redo the moved node. full rebuild when range changes.
+#
+# the engine uses it to find receivers: neighbors of the sender sorted by
+# distance, so the ring a signal newly covers is a bisect, not a search.
+# also for analytics, ie true shortest path hop counts.
+class Graph:
+    def __init__(self):
+        self.range = None
+        self.nodes = {}
+        self.pos = {}
+        self.adj = {}
+        # addr: (sorted squared distances, neighbors in that order)
+        self._rings = {}
+        self.dirty = True
+
+    def __len__(self):
+        return len(self.adj)
+
+    def _d2(self, a, b):
+        ax, ay = self.pos[a]
+        bx, by = self.pos[b]
+        return (ax-bx)*(ax-bx) + (ay-by)*(ay-by)
+
+    def rebuild(self, nodes, range):
+        self.range = range
+        self.nodes = {n.addr : n for n in nodes}
+        self.pos = {n.addr : n.position for n in nodes}
+        self.adj = {n.addr : set() for n in nodes}
+        self._rings = {}
+        grid = Grid()
+        grid.rebuild(nodes)
+        for n in nodes:
+            for m in grid.ring(n.position, 0, range):
+                if m is not n:
+                    self.adj[n.addr].add(m.addr)
+        self.dirty = False
+
+    # recompute edges of one node only, ie while it's dragged
+    def move(self, node):
+        addr = node.addr
+        if self.dirty or self.pos.get(addr) == node.position:
+            return
+        self.pos[addr] = node.position
+        r2 = self.range * self.range
+        old = self.adj[addr]
+        new = set()
+        for other in self.adj:
+            if other != addr and self._d2(addr, other) < r2:
+                new.add(other)
+        for other in old - new:
+            self.adj[other].discard(addr)
+        for other in new - old:
+            self.adj[other].add(addr)
+        self.adj[addr] = new
+        # distances to addr changed for old and new neighbors
+        for other in old | new:
+            self._rings.pop(other, None)
+        self._rings.pop(addr, None)
+
+    def neighbors(self, addr):
+        return self.adj.get(addr, set())
+
+    def _ring(self, addr):
+        r = self._rings.get(addr)
+        if r is None:
+            # ties broken by address so order never depends on set order
+            pairs = sorted((self._d2(addr, o), o) for o in self.adj[addr])
+            r = ([d for d, _ in pairs], [self.nodes[o] for _, o in pairs])
+            self._rings[addr] = r
+        return r
+
+    # graph is only exact for signals sent from where the sender is now,
+    # with no more than the current range
+    def covers(self, signal):
+        return (not self.dirty and signal.range <= self.range and
+                self.pos.get(signal.src_addr) == signal.position)
+
+    # (signal, node) pairs newly reached since signal.covered
+    def reached(self, signals):
+        for signal in signals:
+            d2s, nodes = self._ring(signal.src_addr)
+            lo = bisect_left(d2s, signal.covered * signal.covered)
+            hi = bisect_left(d2s, signal.radius * signal.radius)
+            for i in range(lo, hi):
+                yield signal, nodes[i]
+
+    # hop counts from src to every online node it can reach
+    def hop_counts(self, src):
+        hops = {src : 0}
+        q = deque([src])
+        while q:
+            a = q.popleft()
+            for b in self.adj[a]:
+                if b not in hops and self.nodes[b].online:
+                    hops[b] = hops[a] + 1
+                    q.append(b)
+        return hops
+
+    # shortest path hops src -> dest, None if unreachable
+    def hops(self, src, dest):
+        if src not in self.adj or not self.nodes[src].online:
+            return None
+        return self.hop_counts(src).get(dest)
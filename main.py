@@ -1,9 +1,10 @@
 import time
+from collections import deque
 
-from random import randbytes, randint, choice
+from random import choice
 import logging
 
-from node import Node as AODVNode
+from engine import Engine, Settings as EngineSettings
 from packet import AODVType
 import sim_config as cfg
 
@@ -127,84 +128,118 @@ class Ping:
             if time.time() > self.timeout:
                 self.expired = True
 
-# global settings
-class Settings:
-    def __getitem__(self, key):
-        return self.__dict__.get(key, None)
-    def __setitem__(self, key, val):
-        if key in self.__dict__.keys():
-            self.__setattr__(key, val)
-    def __init__(self):
-        self.default()
+# global settings, engine settings + gui stuff
+class Settings(EngineSettings):
     def default(self):
-        self.paused = False
-        self.num_nodes = len(cfg.NODE_NAMES)
+        super().default()
         self.sender = cfg.NODE_NAMES[0]
         self.recver = cfg.NODE_NAMES[1]
-        self.range = cfg.DEFAULT_RANGE
-        self.speed = cfg.DEFAULT_SPEED
         self.log_level = 'DEBUG'
         self.show_ranges = False
         self.shift_held = False
 
+# per node log for the viewer. %-style args like logging: nothing is
+# formatted until read(), and calls below the active level return early.
+# addresses stay bytes in the entries, names are put in once per entry
+# when it's first rendered
 class NodeLogger:
     class LogEntry:
-        def __repr__(self) -> str:
-            return f'{self.t}:{cfg.LOGLEVEL2NAME[self.l]}:{self.m}'
-        def __init__(self, level, msg) -> None:
-            self.t = time.strftime("%H:%M:%S")
+        def __init__(self, level, msg, args) -> None:
+            self.t = time.time()
             self.l = level
             self.m = msg
-    def __init__(self, level=cfg.LOGNAME2LEVEL['INFO'], max_lines=20) -> None:
-        self.queue = []
+            self.args = args
+            self.text = None
+        def render(self, names):
+            if self.text is None:
+                msg = self.m % tuple(_named(a, names) for a in self.args) if self.args else self.m
+                t = time.strftime("%H:%M:%S", time.localtime(self.t))
+                self.text = f'{t}:{cfg.LOGLEVEL2NAME[self.l]}:{msg}'
+            return self.text
+    def __init__(self, level=lambda: cfg.LOGNAME2LEVEL['INFO'], max_lines=20) -> None:
+        self.queue = deque(maxlen=max_lines)
         self.max_lines = max_lines
         self.level = level
         self.ready = False
-    def _enque(self, msg, level):
-        self.queue.append(self.LogEntry(level, msg))
-        while len(self.queue) > self.max_lines:
-            self.queue.pop(0)
+    def _enque(self, level, msg, args):
+        if level < self.level():
+            return
+        self.queue.append(self.LogEntry(level, msg, args))
         self.ready = True
-    def debug(self, msg):
-        self._enque(msg, cfg.LOGNAME2LEVEL['DEBUG'])
-    def info(self, msg):
-        self._enque(msg, cfg.LOGNAME2LEVEL['INFO'])
-    def warning(self, msg):
-        self._enque(msg, cfg.LOGNAME2LEVEL['WARNING'])
-    def error(self, msg):
-        self._enque(msg, cfg.LOGNAME2LEVEL['ERROR'])
-    def critical(self, msg):
-        self._enque(msg, cfg.LOGNAME2LEVEL['CRITICAL'])
+    def debug(self, msg, *args):
+        self._enque(cfg.LOGNAME2LEVEL['DEBUG'], msg, args)
+    def info(self, msg, *args):
+        self._enque(cfg.LOGNAME2LEVEL['INFO'], msg, args)
+    def warning(self, msg, *args):
+        self._enque(cfg.LOGNAME2LEVEL['WARNING'], msg, args)
+    def error(self, msg, *args):
+        self._enque(cfg.LOGNAME2LEVEL['ERROR'], msg, args)
+    def critical(self, msg, *args):
+        self._enque(cfg.LOGNAME2LEVEL['CRITICAL'], msg, args)
     
-    def read(self):
+    # names: { addr : nickname }
+    def read(self, names={}):
         self.ready = False
-        return '\n'.join([str(q) for q in self.queue if q.l >= self.level()])
-
-# node class
+        level = self.level()
+        return '\n'.join([q.render(names) for q in self.queue if q.l >= level])
+
+# log arg with addresses swapped for names
+def _named(arg, names):
+    if isinstance(arg, bytes):
+        return names.get(arg, arg)
+    if isinstance(arg, (list, tuple)):
+        return [_named(a, names) for a in arg]
+    if isinstance(arg, (str, int, float)) or arg is None:
+        return arg
+    # some object with addresses in its repr
+    out = str(arg)
+    for k, v in names.items():
+        out = out.replace(str(k), v)
+    return out
+
+# signal colors by aodv type
+TYPE2COLOR = { AODVType.RREQ : cfg.RREQ_COLOR,
+               AODVType.RREP : cfg.RREP_COLOR,
+               AODVType.RERR : cfg.RERR_COLOR,
+               AODVType.HELLO : cfg.HELLO_COLOR,
+               AODVType.ACK : cfg.ACK_COLOR,
+               AODVType.DATA : cfg.DATA_COLOR}
+
+# node sprite, draws an engine node
 class SimNode(pg.sprite.Sprite):
-    def __init__(self, parent, addr, nickname, position):
+    def __init__(self, parent, node):
         super().__init__(parent.nodes)
-        self.signals = parent.signals
         self.settings = parent.settings
-        self.addr = addr
-        self.nickname = nickname
-        self.log = NodeLogger(level=lambda:cfg.LOGNAME2LEVEL.get(self.settings.__getitem__('log_level')))
-        self.aodv = AODVNode(node_addr=self.addr, nickname=nickname, logger=self.log)
+        self.node = node
         self.image = pg.Surface(cfg.NODE_SPRITE_DIM)
         self.color = cfg.NODE_COLOR
         self.range_color = choice(cfg.RANDOM_COLORS)
-        self.rect = self.image.get_rect(center=position)
-        self.inbox = []
-        self.online = True
+        self.rect = self.image.get_rect(center=node.position)
         self.dragging = False
         self.set_range_visible = lambda l: self.settings.__setattr__('show_ranges', l)
         self.get_range_visible = lambda: self.settings.__getitem__('show_ranges')
         self.set_as_sender = lambda: parent.set_active_node('sender', self.nickname)
         self.set_as_recver = lambda: parent.set_active_node('recver', self.nickname)
-    
-    def emit_signal(self, payload=b'', color='red'):
-        self.signals.add(Transmission(parent=self, payload=payload, color=color))
-    
+
+    @property
+    def addr(self):
+        return self.node.addr
+    @property
+    def nickname(self):
+        return self.node.nickname
+    @property
+    def aodv(self):
+        return self.node.aodv
+    @property
+    def log(self):
+        return self.node.aodv.log
+    @property
+    def inbox(self):
+        return self.node.inbox
+    @property
+    def online(self):
+        return self.node.online
+
     def update(self, events=[]):
 
         # if click on node
@@ -226,38 +261,10 @@ class SimNode(pg.sprite.Sprite):
                 self.set_range_visible(False)
             if event.type == pg.MOUSEMOTION and self.dragging:
                 self.rect.move_ip(event.rel)
-                
+                self.node.position = self.rect.center
 
-        # update aodv if node online
-        if self.online and not self.settings.paused:
-            raw = self.aodv.update()
-
-            # get signal type for color
-            if raw:
-                if len(raw) < 24:
-                    c = cfg.UNKNOWN_COLOR
-                elif raw[16] == AODVType.RREQ: # rreq
-                    c = cfg.RREQ_COLOR
-                elif raw[16] == AODVType.RREP: # rrep
-                    c = cfg.RREP_COLOR
-                elif raw[16] == AODVType.RERR: # rerr
-                    c = cfg.RERR_COLOR
-                elif raw[16] == AODVType.HELLO: # hello
-                    c = cfg.HELLO_COLOR
-                elif raw[16] == AODVType.ACK: # hello
-                    c = cfg.ACK_COLOR
-                elif raw[16] == AODVType.DATA: # data
-                    c = cfg.DATA_COLOR
-                else:
-                    return cfg.UNKNOWN_COLOR
-                self.emit_signal(raw, c)
-            
-            rx = self.aodv.pop_rx()
-            if rx:
-                self.inbox.append(rx)
-    
     def toggle_online(self):
-        self.online = not self.online
+        self.node.toggle_online()
         if self.online:
             self.color = cfg.NODE_COLOR
         else:
@@ -276,29 +283,10 @@ class SimNode(pg.sprite.Sprite):
         addr_pos = self.rect.x, self.rect.y - 25
         surface.blit(self.addr_surf, addr_pos)
 
-
-    
-        
-# signal class
-class Transmission(pg.sprite.Sprite):
-    def __init__(self, parent, payload:bytes, color:str='red'):
-        super().__init__(parent.signals)
-        self.src_addr = parent.addr
-        self.payload = payload
-        self.position = parent.rect.center
-        self.speed = parent.settings.speed
-        self.range = parent.settings.range  # Adjust as needed
-        self.radius = 1
-        self.collided = []
-        self.color = pg.Color(color)
-
-    def update(self):
-        self.radius += self.speed
-        if self.radius > self.range:
-            self.kill()  # Remove the sprite when it reaches max radius
-
-    def draw(self, surface):
-        pg.draw.circle(surface, self.color, self.position, self.radius, 1)
+# draw an engine signal ring
+def draw_signal(surface, signal):
+    color = pg.Color(TYPE2COLOR.get(signal.aodvtype, cfg.UNKNOWN_COLOR))
+    pg.draw.circle(surface, color, signal.position, signal.radius, 1)
 
 # view node internal states
 class NodeViewer(UIPanel):
@@ -334,6 +322,10 @@ class NodeViewer(UIPanel):
     
     # rebuild all dropdowns
     def refresh(self):
+        # force a redraw of everything
+        self._info_key = None
+        self._data_key = None
+        self._online = None
         try:
             self.node_dropdown.kill()
             self.mode_dropdown.kill()
@@ -385,9 +377,7 @@ class NodeViewer(UIPanel):
         
     def _print_log(self):
         if self.active_node().log.ready:
-            out = self.active_node().log.read()
-            for k,v in self.parent.addr2name.items():
-                out = out.replace(str(k), v)
+            out = self.active_node().log.read(self.parent.addr2name)
             self.data_box.set_text(out)
     
     def _print_neighbors(self):
@@ -398,24 +388,42 @@ class NodeViewer(UIPanel):
             out += f'\n{a2n[k]:<9}{v.rssi:<5}{v.snr:<5}{v.retries:<6}{v.remaining()}'
         self.data_box.set_text(out)
     
+    # set_text re-layouts the whole box, so only redraw what changed:
+    # node state by its version, countdown columns once a second
     def update(self, time_delta: float):
+        n = self.active_node()
+
         # update button text
-        if self.active_node().online:
-            self.online_button.set_text('online')
-        else:
-            self.online_button.set_text('offline')
-
-        self._print_info()
-        if self.mode == 'routes':
-            self._print_routes()
-        if self.mode == 'precursors':
-            self._print_precursors()
-        elif self.mode == 'neighbors':
-            self._print_neighbors()
-        elif self.mode == 'inbox':
-            self._print_inbox()
-        elif self.mode == 'log':
+        if n.online != self._online:
+            self._online = n.online
+            self.online_button.set_text('online' if n.online else 'offline')
+
+        key = (n.nickname, self.mode, n.aodv.seq_num, n.aodv.rreq_id)
+        if key != self._info_key:
+            self._info_key = key
+            self._print_info()
+
+        if self.mode == 'log':
+            # switched node or mode, show the whole log again
+            key = (n.nickname, self.mode)
+            if key != self._data_key:
+                self._data_key = key
+                n.log.ready = True
             self._print_log()
+            return super().update(time_delta)
+
+        countdown = int(time.time()) if self.mode in ('routes', 'neighbors') else 0
+        key = (n.nickname, self.mode, n.aodv.version, len(n.inbox), countdown)
+        if key != self._data_key:
+            self._data_key = key
+            if self.mode == 'routes':
+                self._print_routes()
+            elif self.mode == 'precursors':
+                self._print_precursors()
+            elif self.mode == 'neighbors':
+                self._print_neighbors()
+            elif self.mode == 'inbox':
+                self._print_inbox()
         return super().update(time_delta)
 
 class Controller(UIPanel):
@@ -426,7 +434,6 @@ class Controller(UIPanel):
         self.manager = parent.manager
         self.settings = parent.settings
         self.nodes = parent.nodes
-        self.signals = parent.signals
 
         # col 0
         self.ping_button = Button(self, 'ping', self.send_ping, 0, 0)
@@ -437,10 +444,21 @@ class Controller(UIPanel):
 
         # col 1
 
-        self.signals_status = StatusBar(self, 'signals', 6, 2, self.signals.__len__)   
+        self.signals_status = StatusBar(self, 'signals', 6, 2, lambda: len(self.parent.engine.signals))   
+        self.hops_status = StatusBar(self, 'hops', 6, 3, self.route_hops)
+        self.bytes_status = StatusBar(self, 'bytes', 6, 4, lambda: self.parent.engine.snapshot().get('tx_bytes', 0))
 
         self.refresh()     
     
+    # sender -> receiver shortest path for the status bar. status bars want
+    # a number: -1 before nodes exist or if unreachable
+    def route_hops(self):
+        e = self.parent.engine
+        if not (self.settings.sender in e.name2addr and self.settings.recver in e.name2addr):
+            return -1
+        h = e.hops(self.settings.sender, self.settings.recver)
+        return -1 if h is None else h
+
     def send_ping(self):
         s = self.settings.sender
         r = self.settings.recver        
@@ -493,8 +511,9 @@ class Simulation:
         self.sim_surf.fill(cfg.SIM_COLOR)
 
         self.clock = pg.time.Clock()
+        self.engine = Engine(settings=self.settings,
+                             logger_factory=lambda n: NodeLogger(level=lambda:cfg.LOGNAME2LEVEL.get(self.settings.__getitem__('log_level'))))
         self.nodes = pg.sprite.Group()
-        self.signals = pg.sprite.Group()
 
         self.ctl = Controller(self)
         self.send_view = NodeViewer(self, 'sender', 0)
@@ -539,44 +558,21 @@ class Simulation:
         self.send_view.refresh()
         self.recv_view.refresh()
 
-    def detect_collisions(self):
-        for signal in self.signals:
-            for node in self.nodes:
-                # check collisions
-                if not signal.src_addr == node.addr:
-                    # get distance to node
-                    node_center = pg.Vector2(node.rect.center)
-                    signal_center = pg.Vector2(signal.position)
-                    distance = node_center.distance_to(signal_center)
-
-                    # colliding = distance < signal.radius
-                    if node.online and distance < signal.radius:
-                        if not node.addr in signal.collided:
-                            signal.collided.append(node.addr)
-                            node.aodv.on_recv(signal.payload)
-    
     # generate random nodes
     def reset_nodes(self, default_settings=False):
         if default_settings:
             self.settings.default()
             self.ctl.refresh()
-        self.name2addr = {}
-        self.addr2name = {}
         self.name2node = {}
         # clear old stuff
         self.nodes.empty()
-        self.signals.empty()
         self.sim_surf.fill(pg.Color(cfg.SIM_COLOR))
         # create some nodes
-        for n in cfg.NODE_NAMES[:self.settings.num_nodes]:
-            x = randint(cfg.SIM_X_MARGIN, cfg.SIM_WIDTH - cfg.SIM_X_MARGIN)
-            y = randint(cfg.SIM_Y_MARGIN, cfg.SIM_HEIGHT - cfg.SIM_Y_MARGIN)
-            addr = randbytes(8)
-            node = SimNode(self, addr, n, (x,y))
-            self.nodes.add(node)
-            self.name2addr[n] = addr
-            self.addr2name[addr] = n
-            self.name2node[n] = node
+        self.engine.reset_nodes()
+        self.name2addr = self.engine.name2addr
+        self.addr2name = self.engine.addr2name
+        for node in self.engine.nodes:
+            self.name2node[node.nickname] = SimNode(self, node)
 
     def run(self):
         while self.running:
@@ -667,16 +663,15 @@ class Simulation:
 
             if not self.settings.paused:
                 # logical stuff
-                self.signals.update()
                 self.nodes.update(events)
-                self.detect_collisions()
+                self.engine.step()
 
                 # graphical stuff
                 self.screen.blit(self.sim_surf, (0, 0))
                 self.sim_surf.fill(cfg.SIM_COLOR)
                 self.nodes.draw(self.sim_surf)
-                for s in self.signals:
-                    s.draw(self.sim_surf)
+                for s in self.engine.signals:
+                    draw_signal(self.sim_surf, s)
                 for n in self.nodes:
                     n.draw(self.screen)
             
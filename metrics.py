@@ -0,0 +1,131 @@
+from packet import AODVType
+
+
+# per node counters and histograms. nodes get NULL by default, which does
+# nothing, so instrumentation costs one no-op call when disabled.
+#
+#   m = Metrics()
+#   node = Node(addr, metrics=m)
+#   ...
+#   m.snapshot()  ->  { 'tx_rreq' : 3, 'discovery_latency' : {...}, ... }
+#
+# snapshots are plain dicts, merge them with aggregate()
+
+
+# aodvtype -> lowercase name, ie 1 -> 'rreq'
+TYPE_NAMES = { v : k.lower() for k, v in AODVType.__dict__.items() if k.isupper() }
+# counter names per aodvtype, built once so hot paths don't format strings
+TX_KEYS = { t : f'tx_{n}' for t, n in TYPE_NAMES.items() }
+TX_BYTES_KEYS = { t : f'tx_bytes_{n}' for t, n in TYPE_NAMES.items() }
+RX_KEYS = { t : f'rx_{n}' for t, n in TYPE_NAMES.items() }
+
+# histogram bucket upper bounds, seconds
+BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 16, 32, 64)
+
+
+class Histogram:
+    def __init__(self, bounds=BUCKETS):
+        self.bounds = bounds
+        # last bucket is everything above the last bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.n = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+    def observe(self, value):
+        i = 0
+        for b in self.bounds:
+            if value <= b:
+                break
+            i += 1
+        self.counts[i] += 1
+        self.n += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+    def snapshot(self):
+        return { 'n' : self.n,
+                 'sum' : self.total,
+                 'min' : self.min,
+                 'max' : self.max,
+                 'mean' : self.total / self.n if self.n else None,
+                 'bounds' : self.bounds,
+                 'counts' : list(self.counts) }
+
+
+class Metrics:
+    def __bool__(self):
+        return True
+    def __init__(self):
+        self.counters = {}
+        self.hists = {}
+    def incr(self, name, n=1):
+        c = self.counters
+        c[name] = c.get(name, 0) + n
+    def observe(self, name, value):
+        h = self.hists.get(name)
+        if h is None:
+            h = self.hists[name] = Histogram()
+        h.observe(value)
+    # frame leaving the node
+    def tx(self, raw):
+        t = raw[16] if len(raw) > 16 else AODVType.UNKNOWN
+        c = self.counters
+        k = TX_KEYS.get(t, 'tx_unknown')
+        c[k] = c.get(k, 0) + 1
+        k = TX_BYTES_KEYS.get(t, 'tx_bytes_unknown')
+        c[k] = c.get(k, 0) + len(raw)
+        c['tx_bytes'] = c.get('tx_bytes', 0) + len(raw)
+    # valid frame received
+    def rx(self, aodvtype):
+        c = self.counters
+        k = RX_KEYS.get(aodvtype, 'rx_unknown')
+        c[k] = c.get(k, 0) + 1
+    def snapshot(self):
+        out = dict(self.counters)
+        for k, h in self.hists.items():
+            out[k] = h.snapshot()
+        return out
+
+
+# disabled metrics, same interface, does nothing
+class NullMetrics:
+    def __bool__(self):
+        return False
+    def incr(self, name, n=1):
+        pass
+    def observe(self, name, value):
+        pass
+    def tx(self, raw):
+        pass
+    def rx(self, aodvtype):
+        pass
+    def snapshot(self):
+        return {}
+
+NULL = NullMetrics()
+
+
+# merge node snapshots into network wide totals
+def aggregate(snapshots):
+    out = {}
+    for s in snapshots:
+        for k, v in s.items():
+            if not isinstance(v, dict):
+                out[k] = out.get(k, 0) + v
+                continue
+            h = out.get(k)
+            if h is None:
+                out[k] = dict(v, counts=list(v['counts']))
+                continue
+            h['n'] += v['n']
+            h['sum'] += v['sum']
+            h['counts'] = [a + b for a, b in zip(h['counts'], v['counts'])]
+            if v['min'] is not None and (h['min'] is None or v['min'] < h['min']):
+                h['min'] = v['min']
+            if v['max'] is not None and (h['max'] is None or v['max'] > h['max']):
+                h['max'] = v['max']
+            h['mean'] = h['sum'] / h['n'] if h['n'] else None
+    return out
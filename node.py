@@ -1,15 +1,25 @@
-import time
-from collections import deque
+from collections import deque, OrderedDict
 from binascii import hexlify
+from math import ceil
 
 import node_config as config
 from packet import *
+from scheduler import wall_clock, perf_clock
+from metrics import NULL as NULL_METRICS
 
 try:
     import logging
 except:
     import ulogging as logging
 
+try:
+    import heapq
+except:
+    import uheapq as heapq
+
+# rerr carries one destination plus up to 31 more (5 bit count)
+RERR_MAX_DESTS = 0b11111
+
 # util: unsigned increment
 def uincr(x, y=1):
     return (x+y)%4294967296
@@ -32,11 +42,22 @@ def conform_address(addr):
         return b'\xff'*(8-l) + addr
 
 # simple timeout base class
+# __slots__ all the way down: no per instance __dict__, there are a lot
+# of these in big sims. subclasses list only their own fields
 class Expirable:
+    __slots__ = ('clock', 'timestamp', 'lifetime', 'retries', 'callback', 'skip_last', 'alive')
     def __repr__(self):
-        return '<'+','.join(f"{k}={v}" for k, v in self.__dict__.items())+'>'
-    def __init__(self, lifetime, retries=0, callback=None, skip_last_callback=False):
-        self.timestamp = time.time()
+        return '<'+','.join(f"{k}={getattr(self, k)}" for k in self._fields() if not k in ('clock', 'callback'))+'>'
+    # slot names from base class down
+    @classmethod
+    def _fields(cls):
+        out = []
+        for c in reversed(cls.__mro__):
+            out.extend(c.__dict__.get('__slots__', ()))
+        return out
+    def __init__(self, lifetime, retries=0, callback=None, skip_last_callback=False, clock=wall_clock):
+        self.clock = clock
+        self.timestamp = clock()
         self.lifetime = lifetime
         self.retries = retries
         self.callback = callback
@@ -57,25 +78,54 @@ class Expirable:
         return self.alive
     def reset(self, lifetime):
         self.lifetime = lifetime
-        self.timestamp = time.time()
+        self.timestamp = self.clock()
         self.alive = True
     def remaining(self):
         if self.alive:
-            return int(self.timestamp + self.lifetime - time.time())
+            # not expired by update yet, but can already be past due
+            return max(0, int(self.timestamp + self.lifetime - self.clock()))
         else:
             return 0
+    def deadline(self):
+        return self.timestamp + self.lifetime
+
+# min-heap of expirables keyed by deadline, so update only touches the
+# ones that are due. handler(key, exp, t) is called on each due entry and
+# returns True to re-arm, ie expirable was reset or retried
+class Timers:
+    def __len__(self):
+        return len(self.heap)
+    def __init__(self):
+        self.heap = []
+        self.seq = 0
+    def add(self, exp:Expirable, handler, key=None):
+        self.seq += 1
+        heapq.heappush(self.heap, (exp.deadline(), self.seq, exp, handler, key))
+    # earliest deadline, None if empty
+    def next_deadline(self):
+        if self.heap:
+            return self.heap[0][0]
+        return None
+    def update(self, curr_time):
+        heap = self.heap
+        while heap and heap[0][0] <= curr_time:
+            _, _, exp, handler, key = heapq.heappop(heap)
+            if handler(key, exp, curr_time):
+                self.add(exp, handler, key)
 
 # blacklisted node
 class BadNode(Expirable):
-    def __init__(self, orig_addr):
-        super().__init__(lifetime=config.BLACKLIST_TIMEOUT)
+    __slots__ = ('orig_addr',)
+    def __init__(self, orig_addr, clock=wall_clock, config=config):
+        super().__init__(lifetime=config.BLACKLIST_TIMEOUT, clock=clock)
         self.orig_addr = orig_addr
 
 
 # outbox data waiting for valid route
 class QueuedData(Expirable):
-    def __init__(self, dest_addr, data):
-        super().__init__(lifetime=config.DATA_QUEUE_TIMEOUT)
+    __slots__ = ('dest_addr', 'data')
+    def __init__(self, dest_addr, data, clock=wall_clock, config=config):
+        super().__init__(lifetime=config.DATA_QUEUE_TIMEOUT, clock=clock)
         self.dest_addr = dest_addr
         self.data = data
 
@@ -83,31 +133,185 @@ class QueuedData(Expirable):
 # expirable rreq structure, pass it a RREQ
 # for blacklisting nodes exhibiting strange behavior
 class RecentRREQ(Expirable):
+    __slots__ = ('orig_addr', 'rreq_id')
     def __eq__(self, other):
         return (self.orig_addr == other.orig_addr and
                 self.rreq_id == other.rreq_id)
-    def __init__(self, rreq:RREQ):
-        super().__init__(lifetime=config.PATH_DISCOVERY_TIME)
+    def __init__(self, rreq:RREQ, clock=wall_clock, config=config):
+        super().__init__(lifetime=config.PATH_DISCOVERY_TIME, clock=clock)
         self.orig_addr = rreq.orig_addr
         self.rreq_id = rreq.rreq_id
 
+# 6.5 duplicate rreq cache, keyed by (orig_addr, rreq_id)
+# every entry has the same lifetime so insertion order is deadline order:
+# expire from the front. live entries are only evicted past MAX_RECENT_RREQS,
+# forgetting a flood still in progress makes the node forward it again
+class RecentRREQCache:
+    def __len__(self):
+        return len(self.entries)
+    def __iter__(self):
+        return iter(self.entries.values())
+    def __init__(self, clock=wall_clock, config=config):
+        self.clock = clock
+        self.config = config
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+    # True if rreq was seen recently, else remember it
+    def seen(self, rreq:RREQ):
+        key = (rreq.orig_addr, rreq.rreq_id)
+        if key in self.entries:
+            self.hits += 1
+            return True
+        self.misses += 1
+        self.entries[key] = RecentRREQ(rreq, self.clock, self.config)
+        if len(self.entries) > self.config.MAX_RECENT_RREQS:
+            # memory cap, expired entries go first
+            self.update(int(self.clock()))
+            while len(self.entries) > self.config.MAX_RECENT_RREQS:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return False
+    def update(self, curr_time):
+        while self.entries:
+            key = next(iter(self.entries))
+            if self.entries[key].update(curr_time):
+                break
+            del self.entries[key]
+            self.expired += 1
+    def next_deadline(self):
+        for r in self.entries.values():
+            return r.deadline()
+        return None
+
+# route discovery in progress. ttl of the last rreq sent, grows per retry
+# with expanding ring search
+class RouteRequest(Expirable):
+    __slots__ = ('ttl', 'start')
+    def __init__(self, ttl, lifetime, retries, callback, clock=wall_clock):
+        super().__init__(lifetime=lifetime, retries=retries, callback=callback,
+                         skip_last_callback=True, clock=clock)
+        self.ttl = ttl
+        # timestamp moves on every retry, this doesn't
+        self.start = self.timestamp
+
+# transmit classes, highest priority first
+TX_CONTROL = 0      # rreq, rrep, rerr, hello
+TX_ACK = 1
+TX_FORWARD = 2      # data relayed for others
+TX_LOCAL = 3        # data sent by this node
+TX_DROP_KEYS = ('tx_drop_control', 'tx_drop_ack', 'tx_drop_forward', 'tx_drop_local')
+
+# outbox: a bounded fifo per transmit class, frames go out from the highest
+# priority class that has any. a full class evicts its own oldest frame, so
+# data can't push out route replies and vice versa
+class TxScheduler:
+    def __len__(self):
+        return self.count
+    def __bool__(self):
+        return self.count > 0
+    def __init__(self, size):
+        self.size = size
+        self.queues = [deque((), size) for _ in TX_DROP_KEYS]
+        self.dropped = [0] * len(TX_DROP_KEYS)
+        # frames in all queues, kept by push/pop so empty checks are cheap
+        self.count = 0
+    # True if the class was full and its oldest frame got dropped
+    def push(self, raw, cls):
+        q = self.queues[cls]
+        full = len(q) >= self.size
+        if full:
+            self.dropped[cls] += 1
+        else:
+            self.count += 1
+        q.append(raw)
+        return full
+    def pop(self):
+        if not self.count:
+            return None
+        for q in self.queues:
+            if q:
+                self.count -= 1
+                return q.popleft()
+        return None
+
+# token bucket for one class of control frames, rate per second with up to
+# one second of burst. frames over the rate wait in a bounded queue, or are
+# dropped, per config RATELIMIT_POLICY. rate 0 = no limit
+class Shaper:
+    def __len__(self):
+        return len(self.held)
+    def __init__(self, name, rate, clock=wall_clock, config=config):
+        self.rate = rate
+        self.burst = max(1, rate)
+        self.tokens = self.burst
+        self.clock = clock
+        self.last = clock()
+        self.queue = config.RATELIMIT_POLICY == 'queue'
+        self.held = deque((), config.RATELIMIT_QUEUE_SZ)
+        # metric names, built once
+        self.queued_key = f'{name}_ratelimited'
+        self.drop_key = f'{name}_ratelimit_drop'
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+    # use a token if there is one and nothing is waiting ahead
+    def take(self):
+        if not self.rate:
+            return True
+        if self.held:
+            return False
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+    # raw if it can go now, else held or dropped. metrics counts both
+    def offer(self, raw, metrics):
+        if self.take():
+            return raw
+        if not self.queue:
+            metrics.incr(self.drop_key)
+        else:
+            # full queue, append evicts the oldest
+            if len(self.held) == self.held.maxlen:
+                metrics.incr(self.drop_key)
+            self.held.append(raw)
+            metrics.incr(self.queued_key)
+        return None
+    # held frames whose tokens came in
+    def release(self):
+        out = []
+        if self.held:
+            self._refill()
+            while self.held and self.tokens >= 1:
+                self.tokens -= 1
+                out.append(self.held.popleft())
+        return out
+
 # passive ack datagrams and rreps
 class PassiveAck(Expirable):
-    def __init__(self, neighbor_addr, seq_num):
+    __slots__ = ('addr', 'seq_num')
+    def __init__(self, neighbor_addr, seq_num, clock=wall_clock, config=config):
         self.addr = neighbor_addr
         self.seq_num = seq_num
-        super().__init__(lifetime=config.PASSIVE_ACK_TIMEOUT)
+        super().__init__(lifetime=config.PASSIVE_ACK_TIMEOUT, clock=clock)
 
 # considered "valid" if seq_num and next hop fields not empty, AND timer not expired
 # always initialized with ACTIVE_ROUTE_TIMEOUT
 class Route(Expirable):
-    def __init__(self, next_hop:bytes, seq_num:int, hops:int, seq_valid:bool, lifetime:int):
-        super().__init__(lifetime=lifetime)
+    __slots__ = ('next_hop', 'seq_num', 'hops', 'seq_valid', 'precursors', 'roundtrip')
+    def __init__(self, next_hop:bytes, seq_num:int, hops:int, seq_valid:bool, lifetime:int, clock=wall_clock):
+        super().__init__(lifetime=lifetime, clock=clock)
         self.next_hop = next_hop
         self.seq_num = seq_num
         self.hops = hops
         self.seq_valid = seq_valid
-        self.precursors = []
+        # ordered set: dict keys, values unused
+        self.precursors = {}
         self.roundtrip = 0.0
     def valid(self):
         v = self.next_hop != b''
@@ -117,8 +321,9 @@ class Route(Expirable):
 
 # track all adjacent nodes, use for next hop unicast if 
 class Neighbor(Expirable):
-    def __init__(self, rssi:int=0, snr:int=0):
-        super().__init__(lifetime=config.ACTIVE_ROUTE_TIMEOUT, retries=2)
+    __slots__ = ('rssi', 'snr')
+    def __init__(self, rssi:int=0, snr:int=0, clock=wall_clock, config=config):
+        super().__init__(lifetime=config.ACTIVE_ROUTE_TIMEOUT, retries=2, clock=clock)
         self.rssi = rssi
         self.snr = snr
 
@@ -137,15 +342,30 @@ class RoutingTable:
         return self.table.items()
     def keys(self):
         return self.table.keys()
-    def __init__(self, my_addr):
+    def __init__(self, my_addr, clock=wall_clock, config=config):
         self.addr = my_addr
+        self.clock = clock
+        self.config = config
         self.table = {}
+        # next hop: {dest: route}, same entries as table, so link breaks
+        # only touch the routes through the broken neighbor
+        self.by_next_hop = {}
+        self.timers = Timers()
+        # bumped on every change, for viewers
+        self.version = 0
     def update(self, curr_time):
-        for route in self.table.values():
-            route.update(curr_time)
-    def add_update(self, addr:bytes, next_hop:bytes=b'', seq_num=0, hops=0, seq_valid=False, lifetime=config.ACTIVE_ROUTE_TIMEOUT):
+        self.timers.update(curr_time)
+    def _route_timeout(self, addr, route, curr_time):
+        # replaced by a newer route
+        if self.table.get(addr) is not route:
+            return False
+        self.version += 1
+        return route.update(curr_time)
+    def add_update(self, addr:bytes, next_hop:bytes=b'', seq_num=0, hops=0, seq_valid=False, lifetime=None):
         if addr == self.addr:
             return False
+        if lifetime is None:
+            lifetime = self.config.ACTIVE_ROUTE_TIMEOUT
         old = self.table.get(addr)
         if old:
             if ((seq_num - old.seq_num < 0) or
@@ -154,59 +374,129 @@ class RoutingTable:
                 pass
             else:
                 return False
-        self.table[addr] = Route(next_hop=next_hop, seq_num=seq_num, hops=hops, seq_valid=seq_valid, lifetime=lifetime)
+        route = Route(next_hop=next_hop, seq_num=seq_num, hops=hops, seq_valid=seq_valid, lifetime=lifetime, clock=self.clock)
+        if old:
+            via = self.by_next_hop[old.next_hop]
+            del via[addr]
+            if not via:
+                del self.by_next_hop[old.next_hop]
+        self.table[addr] = route
+        via = self.by_next_hop.get(next_hop)
+        if via is None:
+            via = self.by_next_hop[next_hop] = {}
+        via[addr] = route
+        self.timers.add(route, self._route_timeout, addr)
+        self.version += 1
+        return True
+    def add_precursor(self, addr:bytes, precursor:bytes):
+        route = self.table.get(addr)
+        if route and not precursor in route.precursors:
+            route.precursors[precursor] = None
+            self.version += 1
+    # 6.11 mark route invalid, keeping it (and its next hop) for repairs
+    def invalidate(self, addr:bytes, seq_num:int):
+        route = self.table.get(addr)
+        if route is None or not route.alive:
+            return False
+        route.seq_num = seq_num
+        route.alive = False
+        self.version += 1
         return True
+    # {dest: route} of routes through next_hop
+    def routes_via(self, next_hop:bytes):
+        return self.by_next_hop.get(next_hop, {})
     def dead_dict(self, dead_neighbor:bytes):
-        return {k:v.seq_num for k,v in self.table.items() if v.next_hop == dead_neighbor}
+        return {k:v.seq_num for k,v in self.routes_via(dead_neighbor).items()}
 
 class Node:
     def __repr__(self):
         out = f'NODE:[{self.nickname}]{self.addr}\nSEQ:{self.seq_num},RREQID:{self.rreq_id},'
-        out += f'INBOX:{len(self.rx_fifo)},OUTBOX:{len(self.tx_fifo)}\n'
+        out += f'INBOX:{len(self.rx_fifo)},OUTBOX:{len(self.tx)}\n'
         out += ' == ROUTES == \n'
         out += self.routing_table.__repr__()
         out += '\n == RECENTS == \n'
         out += '\n' + ','.join([str(r) for r in self.recent_rreqs])
         return out
     
-    def __init__(self, node_addr:bytes, nickname:str='', logger=None):
+    def __init__(self, node_addr:bytes, nickname:str='', logger=None, clock=wall_clock, config=config, metrics=None):
 
         self.addr = conform_address(node_addr)
         self.nickname = nickname
         self.log = logger if logger else logging
+        # time source, swap for a virtual clock to run faster than realtime
+        self.clock = clock
+        # settings, node_config module or a node_config.make() per run
+        self.config = config
+        # metrics.Metrics to count tx/rx/drops/discoveries, no-op if None
+        self.metrics = metrics if metrics is not None else NULL_METRICS
 
         self.seq_num = 0
         self.rreq_id = 0
 
         # store known routes. { 8-byte addr : Route() }
-        self.routing_table = RoutingTable(self.addr)
+        self.routing_table = RoutingTable(self.addr, self.clock, self.config)
 
         # aka precursors. handle rerrs etc
         self.neighbors = {}
+        # bumped when neighbors or inbox change, see version
+        self._version = 0
         self.last_hello = 0
         self.last_ack = 0
+        # neighbor that expired during the current update, gets a hello
+        self.expired_neighbor = None
 
         # listen for forwarded packet success by neighbor
         self.passive_acks = []
 
         # store recent received rreqs, to avoid duplicates
-        self.recent_rreqs = []
+        self.recent_rreqs = RecentRREQCache(clock=self.clock, config=self.config)
 
-        # { addr : Expirable }
+        # { addr : RouteRequest }
         self.requested_routes = {}
 
         # blacklist nodes exhibiting strange/malicious behavior
         self.blacklist = []
 
+        # deadlines of everything above, except routes
+        self.timers = Timers()
+
         # packet mailboxes
-        self.rx_fifo = deque((), config.PACKET_INBOX_SZ)
-        self.tx_fifo = deque((), config.PACKET_OUTBOX_SZ)
+        self.rx_fifo = deque((), self.config.PACKET_INBOX_SZ)
+        # outbox by priority, PACKET_OUTBOX_SZ per class
+        self.tx = TxScheduler(self.config.PACKET_OUTBOX_SZ)
+        # frames sent per update, see pop_tx
+        self.tx_budget = self.config.TX_BUDGET
+        self.tx_left = 0
+
+        # inbox packets handled per update, and cpu seconds (0 = no limit)
+        self.rx_budget = self.config.RX_BUDGET
+        self.rx_time_budget = self.config.RX_TIME_BUDGET
+        # inbox counters. dropped = evicted from the full inbox
+        self.rx_processed = 0
+        self.rx_dropped = 0
+
+        # 6.11 unreachable { dest : seq } and precursors to tell, sent as one
+        # rerr per update
+        self.rerr_dests = {}
+        self.rerr_precursors = {}
+        # pending rerr is held back by the rate limit, counted once
+        self.rerr_waiting = False
+
+        # 6.3, 6.11 originated rreqs and rerrs per second
+        self.rreq_shaper = Shaper('rreq', self.config.RREQ_RATELIMIT, self.clock, self.config)
+        self.rerr_shaper = Shaper('rerr', self.config.RERR_RATELIMIT, self.clock, self.config)
 
         # queued outgoing messages
         self.tx_queued = []
-        self.rx_queued = deque((), config.PACKET_INBOX_SZ)
+        self.rx_queued = deque((), self.config.PACKET_INBOX_SZ)
 
     
+    # change counter for viewers: only re-render when this moved.
+    # covers routing table, neighbors and inbox
+    @property
+    def version(self):
+        return self._version + self.routing_table.version
+
     # return nickname if exists, else addr string
     def whoami(self) -> str:
         if self.nickname:
@@ -227,99 +517,178 @@ class Node:
     # MAIN RECV CALLBACK. if valid, packetize, add to inbox
     # all routing stuff handled internally
     # incoming datagrams will show up in data inbox
+    # raw is bytes, or a Frame shared with the other receivers
     def on_recv(self, raw:bytes, rssi=0, snr=0):
         try:
-            p = Packet(raw, rssi, snr)
+            if isinstance(raw, Frame):
+                p = raw.packet(rssi, snr)
+            else:
+                p = Packet(raw, rssi, snr)
+            self.metrics.rx(p.aodvtype)
+            # full inbox, append evicts the oldest
+            if len(self.rx_fifo) >= self.config.PACKET_INBOX_SZ:
+                self.rx_dropped += 1
+                self.metrics.incr('rx_fifo_drop')
             self.rx_fifo.append(p)
-            self.log.debug(f'recv packet: {p.send_addr}')
+            self.log.debug('recv packet: %s', p.send_addr)
         except PacketBadCrcError:
-            self.log.debug(f'recv bad checksum, ignoring packet')
+            self.metrics.incr('rx_bad_crc')
+            self.log.debug('recv bad checksum, ignoring packet')
         except PacketBadLenError:
-            self.log.debug(f'recv bad len, ignoring packet')
+            self.metrics.incr('rx_bad_len')
+            self.log.debug('recv bad len, ignoring packet')
     
     # MAIN UPDATE FUNCTION, call at regular interval
     # updates all internal states, handles inbox/outbox
     # returns next outgoing packet if exists
     def update(self):
-        t = int(time.time())
-
-        # update, repair or purge neighbors
-        rm = []
-        hello = False
-        for k in self.neighbors.keys():
-            self.neighbors[k].update(t)
-            if not self.neighbors[k].alive:
-                hello = True
-                rm.append(k)
-        for k in rm:
-            self.log.info(f'expired neighbor: {k}')
-            del self.neighbors[k]
-        
-        # send hello if havent recently
-        if hello and t >= self.last_hello + config.HELLO_INTERVAL:
-            self.last_hello = t
-            self._send_hello(k)
+        t = int(self.clock())
 
-        # 6.5: update, purge expired recent rreqs
-        for i,_ in enumerate(self.recent_rreqs):
-            self.recent_rreqs[i].update(t)
-            if not self.recent_rreqs[i].alive:
-                r = self.recent_rreqs.pop(i)
-                self.log.debug(f'rm recent rreq: {r}')
-                
+        # expire neighbors, blacklist, route requests, passive acks and
+        # queued data whose deadline passed
+        self.expired_neighbor = None
+        self.timers.update(t)
+
+        # 6.5: purge expired recent rreqs
+        self.recent_rreqs.update(t)
+
+        # send hello if neighbor expired and havent recently
+        if self.expired_neighbor and t >= self.last_hello + self.config.HELLO_INTERVAL:
+            self.last_hello = t
+            self._send_hello(self.expired_neighbor)
 
         # count down route lifetimes
         self.routing_table.update(t)
-        
-        # update blacklist
-        for i,_ in enumerate(self.blacklist):
-            self.blacklist[i].update(t)
-            if not self.blacklist[i].alive:
-                n = self.blacklist.pop(i)
-                self.log.warning(f'unblacklisting: {n}')
-        
-        # update requested routes
-        rm = []
-        for k in self.requested_routes.keys():
-            self.requested_routes[k].update(t)
-            if not self.requested_routes[k].alive:
-                rm.append(k)
-        for k in rm:
-            self.log.warning(f'exp route req: {k}')
-            del self.requested_routes[k]
-        
-        # update awaiting acks
-        for i,_ in enumerate(self.passive_acks):
-            self.passive_acks[i].update(t)
-            if not self.passive_acks[i].alive:
-                n = self.passive_acks.pop(i)
-                self.log.warning(f'UNACKED ROUTE: {n}')
-                self._send_rerr(n.addr)
-
-        
-        # update queued data
-        for i,d in enumerate(self.tx_queued):
-            route = self.routing_table[d.dest_addr]
-            if route and route.valid():
-                self.log.info(f'found route for queued: {d}')
-                dd = self.tx_queued.pop(i)
-                self._send_data(dd.dest_addr, dd.data)
-            else:
-                self.tx_queued[i].update(t)
-                if not self.tx_queued[i].alive:
-                    self.log.warning(f'expired queued data: {d}')
-                    self.tx_queued.pop(i)
 
+        # send queued data once a route shows up
+        if self.tx_queued:
+            waiting = []
+            for d in self.tx_queued:
+                route = self.routing_table[d.dest_addr]
+                if route and route.valid():
+                    self.log.info('found route for queued: %s', d)
+                    self._send_data(d.dest_addr, d.data)
+                else:
+                    waiting.append(d)
+            self.tx_queued = waiting
 
-        # process next packet in inbox
+        # process inbox, up to rx budget
         self._process_rx()
 
+        # rate limited rreqs whose turn came
+        if self.rreq_shaper.held:
+            for raw in self.rreq_shaper.release():
+                self._queue_tx(raw)
+
+        # aggregated route errors
+        if self.rerr_dests:
+            self._send_rerr()
+
         # process next packet in outbox
         # return raw bytes to be passed to encryption, radio, etc
-        if len(self.tx_fifo):
-            return self.tx_fifo.popleft()
+        self.tx_left = self.tx_budget
+        return self.pop_tx()
+
+    # next outgoing frame by priority. None if the outbox is empty or this
+    # update already sent TX_BUDGET frames. update() returns the first, call
+    # this after it to send more in the same tick
+    def pop_tx(self):
+        if self.tx_left <= 0 or not self.tx.count:
+            return None
+        self.tx_left -= 1
+        raw = self.tx.pop()
+        self.metrics.tx(raw)
+        return raw
+
+    # queue raw frame for sending
+    def _queue_tx(self, raw, forwarded=False):
+        t = raw[16]
+        if t == AODVType.DATA:
+            cls = TX_FORWARD if forwarded else TX_LOCAL
+        elif t == AODVType.ACK:
+            cls = TX_ACK
+        else:
+            cls = TX_CONTROL
+        if self.tx.push(raw, cls):
+            self.metrics.incr('tx_fifo_drop')
+            self.metrics.incr(TX_DROP_KEYS[cls])
+
+    # earliest timer deadline, as the int time update() will act on it
+    # None if nothing pending
+    def next_deadline(self):
+        d = [x for x in (self.timers.next_deadline(),
+                         self.routing_table.timers.next_deadline(),
+                         self.recent_rreqs.next_deadline()) if x is not None]
+        if d:
+            return ceil(min(d))
         return None
 
+    # nothing to do until the next deadline
+    def idle(self):
+        return not (self.rx_fifo or self.tx or self.tx_queued or self.rx_queued or
+                    self.rerr_dests or self.rreq_shaper.held)
+
+    # timer handlers, return True to re-arm
+    def _neighbor_timeout(self, addr, neighbor, t):
+        if self.neighbors.get(addr) is not neighbor:
+            return False
+        self._version += 1
+        if neighbor.update(t):
+            return True
+        self.log.info('expired neighbor: %s', addr)
+        del self.neighbors[addr]
+        self.expired_neighbor = addr
+        return False
+
+    def _blacklist_timeout(self, _, n, t):
+        if n.update(t):
+            return True
+        self.blacklist.remove(n)
+        self.log.warning('unblacklisting: %s', n)
+        return False
+
+    def _requested_route_timeout(self, addr, req, t):
+        # already resolved
+        if self.requested_routes.get(addr) is not req:
+            return False
+        if req.update(t):
+            return True
+        self.log.warning('exp route req: %s', addr)
+        del self.requested_routes[addr]
+        return False
+
+    def _passive_ack_timeout(self, _, n, t):
+        # already acked
+        if not any(a is n for a in self.passive_acks):
+            return False
+        if n.update(t):
+            return True
+        self.passive_acks.remove(n)
+        self.metrics.incr('passive_ack_timeout')
+        self.log.warning('UNACKED ROUTE: %s', n)
+        self._link_break(n.addr)
+        return False
+
+    def _queued_data_timeout(self, _, d, t):
+        # already sent
+        if not any(q is d for q in self.tx_queued):
+            return False
+        if d.update(t):
+            return True
+        self.log.warning('expired queued data: %s', d)
+        self.tx_queued.remove(d)
+        return False
+
+    def _add_passive_ack(self, addr, seq_num):
+        a = PassiveAck(addr, seq_num, self.clock, self.config)
+        self.passive_acks.append(a)
+        self.timers.add(a, self._passive_ack_timeout)
+
+    def blacklist_node(self, orig_addr):
+        n = BadNode(orig_addr, self.clock, self.config)
+        self.blacklist.append(n)
+        self.timers.add(n, self._blacklist_timeout)
+
     # MAIN SEND FUNCTION, sends datagram(s)
     # user should only ever use this to send stuff
     # protocol should handle all route maintenance etc
@@ -341,7 +710,9 @@ class Node:
             # No valid route, initiate route discovery (RREQ)
             self._send_rreq(dest_addr)
             # queue data until route found
-            self.tx_queued.append(QueuedData(dest_addr, data))
+            d = QueuedData(dest_addr, data, self.clock, self.config)
+            self.tx_queued.append(d)
+            self.timers.add(d, self._queued_data_timeout)
         
     # only called when valid route exists
     # push packets into the tx fifo
@@ -367,36 +738,54 @@ class Node:
         if len(data) <= PAYLOAD_MAX_LEN:
             # self.seq_num += 1
             d.set_data(dest_addr=dest_addr, orig_addr=self.addr, orig_seq=self.seq_num, data=data)
-            self.tx_fifo.append(p.construct(AODVType.DATA, self.addr, recv_addr, d.pack(), ttl))
+            self._queue_tx(p.construct(AODVType.DATA, self.addr, recv_addr, d.pack(), ttl))
             if passive:
-                self.passive_acks.append(PassiveAck(recv_addr, self.seq_num))
+                self._add_passive_ack(recv_addr, self.seq_num)
         # data too big for one packet
         else:
             i = 0
             while i < len(data):
                 # self.seq_num += 1
                 d.set_data(dest_addr=dest_addr, orig_addr=self.addr, orig_seq=self.seq_num, data=data[i:i+PAYLOAD_MAX_LEN])
-                self.tx_fifo.append(p.construct(AODVType.DATA, self.addr, recv_addr, d.pack(), ttl))
+                self._queue_tx(p.construct(AODVType.DATA, self.addr, recv_addr, d.pack(), ttl))
                 if passive:
-                    self.passive_acks.append(PassiveAck(recv_addr, self.seq_num))
+                    self._add_passive_ack(recv_addr, self.seq_num)
                 i += PAYLOAD_MAX_LEN
 
     # process inbox
     def _process_rx(self):
-        # exit if inbox empty
-        if not len(self.rx_fifo):
-            return
-        
-        # pop the packet
-        p = self.rx_fifo.popleft()
+        n = 0
+        if self.rx_time_budget:
+            stop = perf_clock() + self.rx_time_budget
+        while len(self.rx_fifo) and n < self.rx_budget:
+            self._process_packet(self.rx_fifo.popleft())
+            n += 1
+            if self.rx_time_budget and perf_clock() >= stop:
+                break
+        self.rx_processed += n
 
+    # process one inbox packet
+    def _process_packet(self, p:Packet):
         # INCREMENT INCOMING HOPS !!!
         # (invalidates checksum. hmm.)
         p.hops += 1
         p.ttl -= 1
 
         # add update neighbor
-        self.neighbors[p.send_addr] = Neighbor(rssi=p.rssi, snr=p.snr)
+        neighbor = self.neighbors.get(p.send_addr)
+        if neighbor:
+            # refresh in place, keeps its timer entry
+            if (neighbor.rssi, neighbor.snr, neighbor.retries) != (p.rssi, p.snr, 2):
+                self._version += 1
+            neighbor.rssi = p.rssi
+            neighbor.snr = p.snr
+            neighbor.retries = 2
+            neighbor.reset(self.config.ACTIVE_ROUTE_TIMEOUT)
+        else:
+            neighbor = Neighbor(rssi=p.rssi, snr=p.snr, clock=self.clock, config=self.config)
+            self.neighbors[p.send_addr] = neighbor
+            self.timers.add(neighbor, self._neighbor_timeout, p.send_addr)
+            self._version += 1
         
         # process aodv control packets
         if p.aodvtype == AODVType.RREQ:
@@ -419,23 +808,21 @@ class Node:
         # add route to neighbor
         self.routing_table.add_update(addr=p.send_addr, next_hop=p.send_addr,
                                         seq_num=0, hops=1,
-                                        seq_valid=False, lifetime=config.ACTIVE_ROUTE_TIMEOUT)
+                                        seq_valid=False, lifetime=self.config.ACTIVE_ROUTE_TIMEOUT)
     
     def _is_too_recent(self, rreq):
         # 6.5: ignore if in recent rreqs!!
-        # first find orig_addr in recent_rreq keys
-        if rreq in self.recent_rreqs:
-            self.log.debug(f'ignoring duplicate rreq: {rreq.orig_addr}')
+        if self.recent_rreqs.seen(rreq):
+            self.log.debug('ignoring duplicate rreq: %s', rreq.orig_addr)
             return True
         else:
-            self.recent_rreqs.append(RecentRREQ(rreq))
-            self.log.debug(f'added recent rreq: {rreq.orig_addr}')
+            self.log.debug('added recent rreq: %s', rreq.orig_addr)
             return False
     
     # what do on recv rreq
     def _recv_rreq(self, p:Packet):
         # parse the packet
-        rreq = RREQ(p.payload)
+        rreq = p.message()
 
         # exit if too recent
         if self._is_too_recent(rreq):
@@ -445,8 +832,8 @@ class Node:
             return
         
         # 6.5.4 cal origin route lifetime
-        life = (2*config.NET_TRAVERSAL_TIME -
-                2 * p.hops * config.NODE_TRAVERSAL_TIME)
+        life = (2*self.config.NET_TRAVERSAL_TIME -
+                2 * p.hops * self.config.NODE_TRAVERSAL_TIME)
         
         route = self.routing_table[rreq.orig_addr]
         if route:
@@ -465,10 +852,10 @@ class Node:
             if uincr(self.seq_num) == rreq.dest_seq:
                 self.seq_num = uincr(self.seq_num)
             
-            r.set_data(dest_addr=self.addr, orig_addr=rreq.orig_addr, dest_seq=self.seq_num, hop_count=p.hops, lifetime=config.MY_ROUTE_TIMEOUT)
+            r.set_data(dest_addr=self.addr, orig_addr=rreq.orig_addr, dest_seq=self.seq_num, hop_count=p.hops, lifetime=self.config.MY_ROUTE_TIMEOUT)
             
             # r.set_flags() #TODO ?
-            self.tx_fifo.append(p.construct(AODVType.RREP, self.addr, p.send_addr, r.pack(), ttl=r.hop_count))
+            self._queue_tx(p.construct(AODVType.RREP, self.addr, p.send_addr, r.pack(), ttl=r.hop_count))
 
         # else forward
         else:
@@ -482,27 +869,28 @@ class Node:
                     r = RREP()
                     r.set_data(dest_addr=rreq.dest_addr, orig_addr=rreq.orig_addr, dest_seq=route.seq_num, hop_count=route.hops+p.hops, lifetime=route.remaining())
                     # r.set_flags() #TODO ?
-                    self.tx_fifo.append(p.construct(AODVType.RREP, self.addr, p.send_addr, r.pack(), ttl=route.hops+p.hops))
+                    self._queue_tx(p.construct(AODVType.RREP, self.addr, p.send_addr, r.pack(), ttl=route.hops+p.hops))
                     # 6.6.3 gratuitous rreps
                     if rreq.gratuitous:
-                        self.log.info(f'send gratuitous rrep:{rreq.dest_addr}')
+                        self.log.info('send gratuitous rrep:%s', rreq.dest_addr)
                         # next hop is dest route next hop
                         next_hop = route.next_hop
                         # must unicast rrep to dest
                         route = self.routing_table[rreq.orig_addr]
                         r.set_data(dest_addr=rreq.orig_addr, orig_addr=rreq.dest_addr, dest_seq=rreq.orig_seq, hop_count=route.hops, lifetime=route.remaining())
                         # r.set_flags()
-                        self.tx_fifo.append(Packet().construct(AODVType.RREP, self.addr, next_hop, r.pack(), ttl=route.hops))
+                        self._queue_tx(Packet().construct(AODVType.RREP, self.addr, next_hop, r.pack(), ttl=route.hops))
 
             else:
-                self.routing_table.add_update(addr=rreq.dest_addr, next_hop=b'', seq_num=rreq.dest_seq, hops=0, seq_valid=False, lifetime=config.INACTIVE_ROUTE_TIMEOUT)
+                self.routing_table.add_update(addr=rreq.dest_addr, next_hop=b'', seq_num=rreq.dest_seq, hops=0, seq_valid=False, lifetime=self.config.INACTIVE_ROUTE_TIMEOUT)
                 if p.recv_addr in [self.addr, BROADCAST_ADDR]:
                     self._fwd_packet(p)
         
 
     # 6.7 receiving + forwarding rreps
     def _recv_rrep(self, p:Packet):
-        rrep = RREP(p.payload)
+        # shared with other receivers, copy before changing
+        rrep = p.message()
         # create route to sender of rrep if not exists
         # shortcut: route is valid if dest == sender
         if rrep.dest_addr == p.send_addr:
@@ -516,10 +904,10 @@ class Node:
         self.routing_table.add_update(addr=p.send_addr, next_hop=p.send_addr, seq_num=seq_num, hops=1, seq_valid=is_neighbor)
         
         # next increment hop count
-        rrep.hop_count += 1
+        hop_count = rrep.hop_count + 1
         
         # create route to dest if not exists
-        self.routing_table.add_update(addr=rrep.dest_addr, next_hop=p.send_addr, seq_num=rrep.dest_seq, hops=rrep.hop_count, seq_valid=True, lifetime=rrep.lifetime)
+        self.routing_table.add_update(addr=rrep.dest_addr, next_hop=p.send_addr, seq_num=rrep.dest_seq, hops=hop_count, seq_valid=True, lifetime=rrep.lifetime)
         
         # only deal with packets sent to me
         if p.recv_addr == self.addr:
@@ -529,37 +917,38 @@ class Node:
                 # resolve requested route
                 if rrep.dest_addr in self.requested_routes.keys():
                     # roundtrip time valid only if dest originated rrep, no an intermediate node
-                    if p.hops == rrep.hop_count:
-                        trip = round(time.time() - self.requested_routes[rrep.dest_addr].timestamp, 3)
+                    if p.hops == hop_count:
+                        trip = round(self.clock() - self.requested_routes[rrep.dest_addr].start, 3)
                     else:
                         trip = -1
+                    self.metrics.incr('discovery_done')
+                    if trip >= 0:
+                        self.metrics.observe('discovery_latency', trip)
                     # update routing table, cleanup
                     self.routing_table[rrep.dest_addr].roundtrip = trip
-                    self.log.debug(f'FOUND ROUTE: {rrep.dest_addr} ROUNDTRIP: {self.routing_table[rrep.dest_addr].roundtrip}')
+                    self.log.debug('FOUND ROUTE: %s ROUNDTRIP: %s', rrep.dest_addr, self.routing_table[rrep.dest_addr].roundtrip)
                     del self.requested_routes[rrep.dest_addr]
             # else fwd
             else:
-                # update rrep lifetime
-                rrep.lifetime = max(rrep.lifetime, config.ACTIVE_ROUTE_TIMEOUT)
                 # get route back to origin
                 orig_route = self.routing_table[rrep.orig_addr]
                 if orig_route and orig_route.valid() and p.recv_addr == self.addr:
-                    self.log.debug(f'fwd rrep. dest:{rrep.dest_addr} ttl:{p.ttl}')
+                    self.log.debug('fwd rrep. dest:%s ttl:%s', rrep.dest_addr, p.ttl)
                     dest_route = self.routing_table[rrep.dest_addr]
                     # next hop toward orig is precursor to dest
-                    if not orig_route.next_hop in dest_route.precursors:
-                        self.routing_table[rrep.dest_addr].precursors.append(orig_route.next_hop)
+                    self.routing_table.add_precursor(rrep.dest_addr, orig_route.next_hop)
                     # next hop toward dest is precursor to orig
-                    if not p.send_addr in orig_route.precursors:
-                        self.routing_table[rrep.orig_addr].precursors.append(p.send_addr)
+                    self.routing_table.add_precursor(rrep.orig_addr, p.send_addr)
                     # 6.7: precursor list for the next hop towards the destination is updated to contain the next hop towards the source.
-                    if dest_route.next_hop in self.routing_table.keys():
-                        if not orig_route.next_hop in self.routing_table[dest_route.next_hop].precursors:
-                            self.routing_table[dest_route.next_hop].precursors.append(orig_route.next_hop)
+                    # no dest route if the rrep is about us, ie a gratuitous one
+                    if dest_route:
+                        self.routing_table.add_precursor(dest_route.next_hop, orig_route.next_hop)
                     
-                    # forward the rrep
-                    p.payload = rrep.pack()
-                    p.payload_len = len(p.payload)
+                    # forward the rrep, updated hop count + lifetime
+                    fwd = rrep.copy()
+                    fwd.hop_count = hop_count
+                    fwd.lifetime = max(rrep.lifetime, self.config.ACTIVE_ROUTE_TIMEOUT)
+                    p.set_payload(fwd.pack())
                     self._fwd_packet(p, orig_route.next_hop)
                 else:
                     # self.log.warning('rrep fwd IGNORED')
@@ -571,34 +960,41 @@ class Node:
                 #TODO
                 pass
 
-    # what do on recv rerr
+    # 6.11 (iii) rerr from a neighbor: drop the routes we have through it
     def _recv_rerr(self, p:Packet):
-        r = RERR(p.payload)
-        print('\ngot rerr!')
-        print(r)
-        #TODO
+        if not p.recv_addr in (self.addr, BROADCAST_ADDR):
+            return
+        r = p.message()
+        dests = {}
+        for addr, seq in zip([r.bad_addr] + r.addr_list, [r.bad_seq] + r.seq_list):
+            route = self.routing_table[addr]
+            if route and route.valid() and route.next_hop == p.send_addr:
+                dests[addr] = seq
+        if dests:
+            self.log.info('recv rerr: %s unreachable via %s', len(dests), p.send_addr)
+            self._route_error(dests)
     
     def _recv_hello(self, p:Packet):
-        h = HELLO(p.payload)
-        self.routing_table.add_update(h.dest_addr, h.dest_addr, h.dest_seq, hops=1, seq_valid=True, lifetime=config.ACTIVE_ROUTE_TIMEOUT)
-        self.log.info(f'recv hello: {p.send_addr}')
-        # t = int(time.time())
-        # if t >= max(self.last_ack + config.ACK_INTERVAL, self.last_hello + config.HELLO_INTERVAL):
+        h = p.message()
+        self.routing_table.add_update(h.dest_addr, h.dest_addr, h.dest_seq, hops=1, seq_valid=True, lifetime=self.config.ACTIVE_ROUTE_TIMEOUT)
+        self.log.info('recv hello: %s', p.send_addr)
+        # t = int(self.clock())
+        # if t >= max(self.last_ack + self.config.ACK_INTERVAL, self.last_hello + self.config.HELLO_INTERVAL):
         #     self._send_ack(recv_addr=p.send_addr, data_seq=0)
         #     self.last_ack = t
     
     def _recv_ack(self, p:Packet):
-        a = ACK(p.payload)
-        self.routing_table.add_update(p.send_addr, p.send_addr, a.orig_seq, hops=1, seq_valid=True, lifetime=config.ACTIVE_ROUTE_TIMEOUT)
+        a = p.message()
+        self.routing_table.add_update(p.send_addr, p.send_addr, a.orig_seq, hops=1, seq_valid=True, lifetime=self.config.ACTIVE_ROUTE_TIMEOUT)
         if p.recv_addr == self.addr:
             for i,ack in enumerate(self.passive_acks):
                 if p.send_addr == ack.addr and a.data_seq == ack.seq_num:   
-                    self.log.info(f'last mile ack: {p.send_addr}')
+                    self.log.info('last mile ack: %s', p.send_addr)
                     self.passive_acks.pop(i)
 
     
     def _recv_data(self, p:Packet):
-        r = DATAGRAM(p.payload)
+        r = p.message()
 
         # update orig route everytime
         self.routing_table.add_update(addr=r.orig_addr, next_hop=p.send_addr, seq_num=r.orig_seq, hops=p.hops, seq_valid=True)
@@ -607,49 +1003,91 @@ class Node:
         if p.recv_addr == self.addr:
             # data is for me
             if r.dest_addr == self.addr:
-                self.log.info(f'recv datagram:{r.data}')
+                self.log.info('recv datagram:%s', r.data)
                 # TODO: remove autoping?
                 if r.data == b'ping':
-                    self.log.info(f'send pong:{r.orig_addr}')
+                    self.log.info('send pong:%s', r.orig_addr)
                     self.send(r.orig_addr, 'pong')
                 else:
                     # send ack after last hop
                     self._send_ack(recv_addr=p.send_addr, data_seq=r.orig_seq)
                 self.rx_queued.append(r)
+                self._version += 1
             # data is for neighbor of mine
             elif r.dest_addr in self.neighbors.keys():
                 self._fwd_packet(p, r.dest_addr)
                 # listen for ack
-                self.passive_acks.append(PassiveAck(r.dest_addr, r.orig_seq))
-                self.log.info(f'awaiting last mile: {r.dest_addr}')
+                self._add_passive_ack(r.dest_addr, r.orig_seq)
+                self.log.info('awaiting last mile: %s', r.dest_addr)
             else:
                 route = self.routing_table[r.dest_addr]
                 if route and route.valid():
                     self._fwd_packet(p, route.next_hop)
-                    self.passive_acks.append(PassiveAck(route.next_hop, r.orig_seq))
+                    self._add_passive_ack(route.next_hop, r.orig_seq)
                 else:
-                    self.log.warning(f'ignore: unrouteable datagram {r.orig_addr}>>>{r.dest_addr}')
-                    self._send_rerr(r.dest_addr)
+                    self.log.warning('ignore: unrouteable datagram %s>>>%s', r.orig_addr, r.dest_addr)
+                    # 6.11 (ii) tell whoever sent it
+                    seq = uincr(route.seq_num) if route else 0
+                    self._route_error({r.dest_addr : seq}, (p.send_addr,))
         # check passive acks
         else:
             for i,a in enumerate(self.passive_acks):
                 if p.send_addr == a.addr and r.orig_seq == a.seq_num:
-                    self.log.info(f'passive ack: {p.send_addr}')
+                    self.log.info('passive ack: %s', p.send_addr)
                     self.passive_acks.pop(i)
 
     # fwd packet, changing just send/recv and checksum
     def _fwd_packet(self, p:Packet, recv_addr:bytes=BROADCAST_ADDR):
         if p.ttl > 0:
-            self.log.debug(f'fwd: {p.send_addr}')
+            self.metrics.incr('fwd')
+            self.log.debug('fwd: %s', p.send_addr)
             p.send_addr = self.addr
             p.recv_addr = recv_addr
-            self.tx_fifo.append(p.pack())
+            self._queue_tx(p.pack(), forwarded=True)
+
+    # 6.4 expanding ring search: rreqs go out with a small ttl, growing by
+    # TTL_INCREMENT per timeout up to TTL_THRESHOLD, then the whole network
+    # (NET_DIAMETER) for RREQ_RETRIES more tries
+    def _ring_ttl(self, ttl=None, route=None):
+        c = self.config
+        if not c.EXPANDING_RING:
+            return c.NET_DIAMETER
+        if ttl is None:
+            # last known distance is a good first guess
+            ttl = route.hops + c.TTL_INCREMENT if route and route.hops else c.TTL_START
+        elif ttl < c.NET_DIAMETER:
+            ttl += c.TTL_INCREMENT
+        return ttl if ttl <= c.TTL_THRESHOLD else c.NET_DIAMETER
+
+    # how long to wait for a rrep to a rreq with this ttl
+    def _ring_timeout(self, ttl):
+        if ttl >= self.config.NET_DIAMETER:
+            return self.config.PATH_DISCOVERY_TIME
+        return self.config.RING_TRAVERSL_TIME * (ttl + self.config.TIMEOUT_BUFFER)
+
+    # tries for a discovery starting at ttl: ring steps, then full floods
+    def _ring_tries(self, ttl):
+        n = 0
+        while ttl < self.config.NET_DIAMETER:
+            ttl = self._ring_ttl(ttl)
+            n += 1
+        return n + self.config.RREQ_RETRIES
+
+    # requested route timed out, widen the ring before the retry goes out
+    def _retry_rreq(self, dest_addr, gratuitous, dest_only):
+        req = self.requested_routes.get(dest_addr)
+        if req:
+            req.ttl = self._ring_ttl(req.ttl)
+            req.lifetime = self._ring_timeout(req.ttl)
+            self.metrics.incr('discovery_retry')
+        self._send_rreq(dest_addr, gratuitous, dest_only)
 
     def _send_rreq(self, dest_addr, gratuitous=True, dest_only=False):
         r = RREQ()
         route = self.routing_table[dest_addr]
         recv = BROADCAST_ADDR
-        ttl = config.NET_DIAMETER
+        req = self.requested_routes.get(dest_addr)
+        ttl = req.ttl if req else self._ring_ttl(route=route)
 
         # setup
         if route:
@@ -676,45 +1114,85 @@ class Node:
         r.set_data(dest_addr, self.addr, dest_seq, self.seq_num, self.rreq_id)
 
         # add to requested routes
-        if not dest_addr in self.requested_routes.keys():
-            self.requested_routes[dest_addr] = Expirable(lifetime=config.PATH_DISCOVERY_TIME,
-                                                         retries=config.RREQ_RETRIES,
-                                                         callback=lambda: self._send_rreq(dest_addr, gratuitous, dest_only),
-                                                         skip_last_callback=True)
-
-        self.tx_fifo.append(Packet().construct(AODVType.RREQ, self.addr, recv, r.pack(), ttl))
-        self.log.debug(f'send rreq: {dest_addr} next: {recv}')
+        if req is None:
+            self.metrics.incr('discovery_start')
+            req = RouteRequest(ttl=ttl,
+                               lifetime=self._ring_timeout(ttl),
+                               retries=self._ring_tries(ttl),
+                               callback=lambda: self._retry_rreq(dest_addr, gratuitous, dest_only),
+                               clock=self.clock)
+            self.requested_routes[dest_addr] = req
+            self.timers.add(req, self._requested_route_timeout, dest_addr)
+
+        raw = self.rreq_shaper.offer(Packet().construct(AODVType.RREQ, self.addr, recv, r.pack(), ttl), self.metrics)
+        if raw:
+            self._queue_tx(raw)
+        self.log.debug('send rreq: %s next: %s ttl: %s', dest_addr, recv, ttl)
     
-    def _send_rerr(self, broken_neighbor_addr:bytes):
+    # 6.11 (i) next hop stopped answering: every valid route through it
+    def _link_break(self, neighbor:bytes):
+        dests = {a : uincr(r.seq_num) for a, r in self.routing_table.routes_via(neighbor).items() if r.valid()}
+        if dests:
+            self._route_error(dests)
+
+    # invalidate routes, queue their destinations for the next rerr
+    def _route_error(self, dests:dict, precursors=()):
+        for addr, seq in dests.items():
+            route = self.routing_table[addr]
+            if route:
+                self.rerr_precursors.update(route.precursors)
+            if self.routing_table.invalidate(addr, seq):
+                self.metrics.incr('route_invalidated')
+            self.rerr_dests[addr] = seq
+        for a in precursors:
+            self.rerr_precursors[a] = None
+
+    # one rerr with as many queued destinations as fit. unicast if a single
+    # precursor needs it, broadcast if more, nothing if none.
+    # over the rate limit, destinations keep aggregating until a token
+    # comes in, or are dropped, per RATELIMIT_POLICY
+    def _send_rerr(self):
+        if not self.rerr_precursors:
+            self.rerr_dests.clear()
+            return
+        shaper = self.rerr_shaper
+        if not shaper.take():
+            if shaper.queue:
+                if not self.rerr_waiting:
+                    self.rerr_waiting = True
+                    self.metrics.incr(shaper.queued_key)
+            else:
+                self.metrics.incr(shaper.drop_key, len(self.rerr_dests))
+                self.rerr_dests.clear()
+                self.rerr_precursors.clear()
+            return
+        self.rerr_waiting = False
+
+        addrs = list(self.rerr_dests)[:RERR_MAX_DESTS + 1]
+        seqs = [self.rerr_dests.pop(a) for a in addrs]
+        pre = list(self.rerr_precursors)
+        if not self.rerr_dests:
+            self.rerr_precursors.clear()
 
-        #TODO: update routing table first
-        
-        seq = self.routing_table[broken_neighbor_addr].seq_num
-        pre = self.routing_table[broken_neighbor_addr].precursors
-        dead = self.routing_table.dead_dict(broken_neighbor_addr)
-        a_list = list(dead.keys())
-        s_list = [dead[k] for k in a_list]
-        no_del = not broken_neighbor_addr in self.neighbors.keys()
         r = RERR()
-        r.set_data(bad_addr=broken_neighbor_addr,
-                   bad_seq=seq,
-                   addr_list=a_list,
-                   seq_list=s_list,
-                   no_delete=no_del)
-        p = Packet()
-        p.construct(AODVType.RERR, self.addr, BROADCAST_ADDR, r.pack(), ttl=1)
-        self.tx_fifo.append(p.pack())
-        self.log.warning(f'send rerr: {broken_neighbor_addr}')
-        self.log.warning(f'pre: {pre}')
+        r.set_data(bad_addr=addrs[0],
+                   bad_seq=seqs[0],
+                   addr_list=addrs[1:],
+                   seq_list=seqs[1:],
+                   no_delete=False)
+        recv = pre[0] if len(pre) == 1 else BROADCAST_ADDR
+        self._queue_tx(Packet().construct(AODVType.RERR, self.addr, recv, r.pack(), ttl=1))
+        self.metrics.incr('rerr_sent')
+        self.log.warning('send rerr: %s unreachable, to %s', len(addrs), recv)
     
     def _send_hello(self, addr=BROADCAST_ADDR):
         h = HELLO()
         h.dest_addr = self.addr
         h.dest_seq = self.seq_num
-        h.lifetime = config.HELLO_LIFETIME
-        self.tx_fifo.append(Packet().construct(aodvtype=AODVType.HELLO, send_addr=self.addr, recv_addr=addr, payload=h.pack(), ttl=1))
+        h.lifetime = self.config.HELLO_LIFETIME
+        self._queue_tx(Packet().construct(aodvtype=AODVType.HELLO, send_addr=self.addr, recv_addr=addr, payload=h.pack(), ttl=1))
     
     def _send_ack(self, recv_addr, data_seq=0):
         a = ACK()
         a.set_data(orig_seq=self.seq_num, data_seq=data_seq)
-        self.tx_fifo.append(Packet().construct(aodvtype=AODVType.ACK, send_addr=self.addr, recv_addr=recv_addr, payload=a.pack(), ttl=1))
\ No newline at end of file
+        self._queue_tx(Packet().construct(aodvtype=AODVType.ACK, send_addr=self.addr, recv_addr=recv_addr, payload=a.pack(), ttl=1))
\ No newline at end of file
@@ -1,7 +1,9 @@
 # settings, per RFC 3561
 
 PACKET_INBOX_SZ = 10
-PACKET_OUTBOX_SZ = 10
+PACKET_OUTBOX_SZ = 10            # per transmit class
+TX_BUDGET = 1                   # max frames sent per update
+RX_TIME_BUDGET = 0              # max cpu seconds per update processing inbox, 0 = no limit
 
 DATA_QUEUE_TIMEOUT = 240 # seconds
 
@@ -16,28 +18,66 @@ ACK_INTERVAL         = 2 # s
 LOCAL_ADD_TTL        = 2
 NET_DIAMETER         = 35
 NODE_TRAVERSAL_TIME  = 1   # s
-RREQ_RATELIMIT       = 10   # max broadcastable rreqs per second
+RREQ_RATELIMIT       = 10   # max originated rreqs per second, 0 = no limit
 RREQ_RETRIES         = 2    # max retries
-RERR_RATELIMIT       = 10
+RERR_RATELIMIT       = 10   # max originated rerrs per second
+RATELIMIT_POLICY     = 'queue'  # over the rate limits: 'queue' or 'drop'
+RATELIMIT_QUEUE_SZ   = 10   # rate limited rreqs held per node
 TIMEOUT_BUFFER       = 2
+EXPANDING_RING       = True # 6.4, False floods every rreq NET_DIAMETER hops
 TTL_START            = 1
 TTL_INCREMENT        = 2
 TTL_THRESHOLD        = 7
 # TTL_VALUE = 
 
-# NET_TRAVERSAL_TIME   = 2 * NODE_TRAVERSAL_TIME * NET_DIAMETER # ms
-NET_TRAVERSAL_TIME   = int(0.2 * NODE_TRAVERSAL_TIME * NET_DIAMETER) # ms
-BLACKLIST_TIMEOUT    = RREQ_RETRIES * NET_TRAVERSAL_TIME      # ms
-MAX_REPAIR_TTL       = 0.3 * NET_DIAMETER
-MY_ROUTE_TIMEOUT     = 2 * ACTIVE_ROUTE_TIMEOUT               # ms
-NEXT_HOP_WAIT        = NODE_TRAVERSAL_TIME + 10
-PATH_DISCOVERY_TIME  = 2 * NET_TRAVERSAL_TIME # ms to buffer rreq after sending, to prevent loops
-RING_TRAVERSL_TIME   = 2 * NODE_TRAVERSAL_TIME
-HELLO_LIFETIME        = ALLOWED_HELLO_LOSS * HELLO_INTERVAL
-
 PATH_DISCOVERY_INCREMENT = 1
 LIFETIME_INCREMENT = 1
-MAX_RECENT_RREQS = 5
+# memory cap on the duplicate rreq cache, applied after expired entries are
+# purged. evicting a live entry makes the node forward that flood again
+MAX_RECENT_RREQS = 1024
 
 NEIGHBOR_MAX_REPAIRS = 2
-PASSIVE_ACK_TIMEOUT = 5
\ No newline at end of file
+PASSIVE_ACK_TIMEOUT = 5
+
+
+# values derived from the ones above. c is a dict of settings, anything
+# named in keep was set explicitly and is left alone
+def derive(c, keep=()):
+    def set(k, v):
+        if not k in keep:
+            c[k] = v
+    set('RX_BUDGET',            c['PACKET_INBOX_SZ'])     # max inbox packets processed per update
+    # set('NET_TRAVERSAL_TIME', 2 * c['NODE_TRAVERSAL_TIME'] * c['NET_DIAMETER']) # ms
+    set('NET_TRAVERSAL_TIME',   int(0.2 * c['NODE_TRAVERSAL_TIME'] * c['NET_DIAMETER'])) # ms
+    set('BLACKLIST_TIMEOUT',    c['RREQ_RETRIES'] * c['NET_TRAVERSAL_TIME'])      # ms
+    set('MAX_REPAIR_TTL',       0.3 * c['NET_DIAMETER'])
+    set('MY_ROUTE_TIMEOUT',     2 * c['ACTIVE_ROUTE_TIMEOUT'])               # ms
+    set('NEXT_HOP_WAIT',        c['NODE_TRAVERSAL_TIME'] + 10)
+    set('PATH_DISCOVERY_TIME',  2 * c['NET_TRAVERSAL_TIME']) # ms to buffer rreq after sending, to prevent loops
+    set('RING_TRAVERSL_TIME',   2 * c['NODE_TRAVERSAL_TIME'])
+    set('HELLO_LIFETIME',       c['ALLOWED_HELLO_LOSS'] * c['HELLO_INTERVAL'])
+    return c
+
+derive(globals())
+
+
+# per run settings, ie for parameter sweeps where runs share a process.
+# same attributes as this module
+class Config:
+    def __repr__(self):
+        return '<'+','.join(f"{k}={v}" for k, v in self.__dict__.items())+'>'
+    def __init__(self, values):
+        self.__dict__.update(values)
+
+# module values with overrides applied and derived values recomputed,
+# ie make(NET_DIAMETER=10) also shortens PATH_DISCOVERY_TIME
+def make(**overrides):
+    c = {k : v for k, v in globals().items() if k.isupper()}
+    for k in overrides:
+        if not k in c:
+            raise AttributeError(f'unknown setting: {k}')
+        # ie 'False' from a command line is truthy
+        if isinstance(c[k], bool) and not isinstance(overrides[k], bool):
+            raise TypeError(f'{k} must be True or False, not {overrides[k]!r}')
+    c.update(overrides)
+    return Config(derive(c, keep=overrides))
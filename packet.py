@@ -1,5 +1,28 @@
 import struct
 
+# micropython has no struct.Struct, same api over the module functions
+try:
+    from struct import Struct
+except ImportError:
+    class Struct:
+        def __init__(self, fmt):
+            self.format = fmt
+            self.size = struct.calcsize(fmt)
+        def pack(self, *v):
+            return struct.pack(self.format, *v)
+        def pack_into(self, buf, offset, *v):
+            struct.pack_into(self.format, buf, offset, *v)
+        def unpack(self, buf):
+            return struct.unpack(self.format, buf)
+        def unpack_from(self, buf, offset=0):
+            return struct.unpack_from(self.format, buf, offset)
+
+# optional, batch checksums
+try:
+    import numpy as np
+except:
+    np = None
+
 DUMMY_ADDR = b'deadbeef'
 
 BROADCAST_ADDR = b'\xff'*8
@@ -8,6 +31,20 @@ HEADER_LEN = 24
 DATAGRAM_HEADER_LEN = 20
 PAYLOAD_MAX_LEN = PACKET_LEN - HEADER_LEN - DATAGRAM_HEADER_LEN
 CHECKSUM_OFFSET = 20
+PAYLOAD_LEN_OFFSET = 19
+
+# precompiled wire formats
+HEADER_FMT = Struct('>8s8sBBBBHH')  # send, recv, type, hops, ttl, payload_len, checksum, reserved
+CHECKSUM_FMT = Struct('>H')
+RREQ_FMT = Struct('>8s8sLLLB')      # dest, orig, dest_seq, orig_seq, rreq_id, flags
+RREP_FMT = Struct('>8s8sLBBL')      # dest, orig, dest_seq, flags, hop_count, lifetime
+RERR_FMT = Struct('>8sLB')          # bad_addr, bad_seq, flags
+RERR_DEST_FMT = Struct('>8sL')      # addr, seq, repeated dest_count times
+ACK_FMT = Struct('>LL')             # orig_seq, data_seq
+DATAGRAM_FMT = Struct('>8s8sLB')    # dest, orig, orig_seq, flags, then data
+
+# packets are packed here, then copied out once
+TX_BUF = bytearray(PACKET_LEN)
 
 class AODVType:
     UNKNOWN = 0
@@ -19,7 +56,8 @@ class AODVType:
     ACK     = 6
 
 
-def compute_fletcher_16(data):
+# reference implementation, modulo on every byte
+def compute_fletcher_16_ref(data):
     sum_l = 0
     sum_h = 0
     for byte in data:
@@ -27,6 +65,106 @@ def compute_fletcher_16(data):
         sum_h = (sum_h + sum_l) % 255
     return sum_h << 8 | sum_l
 
+# bytes summed between reductions, keeps sums in small ints on micropython
+FLETCHER_BLOCK = 4096
+
+# fallback, plain adds with the modulo deferred to block ends
+def fletcher_16_blocks(data):
+    sum_l = 0
+    sum_h = 0
+    n = len(data)
+    i = 0
+    while i < n:
+        for byte in data[i:i+FLETCHER_BLOCK]:
+            sum_l += byte
+            sum_h += sum_l
+        sum_l %= 255
+        sum_h %= 255
+        i += FLETCHER_BLOCK
+    return sum_h << 8 | sum_l
+
+# big ints needed for the fast path, not on every micropython port
+try:
+    int.from_bytes(b'\xff'*16, 'big')
+    BIGINT = True
+except:
+    BIGINT = False
+
+# both sums are linear mod 255, so reduce once per frame in c:
+# read the frame as a base 256 number N. 256**k == 1 + 255*k (mod 255**2),
+# so N == S + 255*W (mod 255**2), with S the byte sum and W the byte sum
+# weighted by distance from the end. sum_l = S, sum_h = S + W (mod 255)
+def compute_fletcher_16(data):
+    if not BIGINT:
+        return fletcher_16_blocks(data)
+    s = sum(data)
+    w = ((int.from_bytes(data, 'big') - s) % 65025) // 255
+    return ((w + s) % 255) << 8 | (s % 255)
+
+# checksums for a list of frames
+# numpy: frames are right aligned into one matrix. leading zeros don't
+# change either sum, so every row gets weights n..1 from the same column
+def fletcher_16_batch(frames):
+    if np is None or not frames:
+        return [compute_fletcher_16(f) for f in frames]
+    m = _frame_matrix(frames)
+    return _fletcher_16_matrix(m).tolist()
+
+def _frame_matrix(frames, min_width=0):
+    width = max(min_width, max(len(f) for f in frames))
+    # same length frames, one copy
+    if all(len(f) == width for f in frames):
+        return np.frombuffer(b''.join(frames), dtype=np.uint8).reshape(len(frames), width).astype(np.int64)
+    m = np.zeros((len(frames), width), dtype=np.int64)
+    for i, f in enumerate(frames):
+        if f:
+            m[i, width-len(f):] = np.frombuffer(f, dtype=np.uint8)
+    return m
+
+def _fletcher_16_matrix(m):
+    weights = np.arange(m.shape[1], 0, -1, dtype=np.int64)
+    sum_l = m.sum(axis=1) % 255
+    sum_h = (m @ weights) % 255
+    return sum_h << 8 | sum_l
+
+# check checksum + payload length of a list of received raw frames
+# returns a list of bools, same order
+def verify_batch(frames):
+    if np is None or not frames:
+        return [_verify(f) for f in frames]
+    ok = [len(f) >= HEADER_LEN and f[PAYLOAD_LEN_OFFSET] == len(f) - HEADER_LEN for f in frames]
+    m = _frame_matrix(frames, HEADER_LEN)
+    rows = np.arange(len(frames))
+    # checksum columns of each right aligned row
+    col = m.shape[1] - np.array([len(f) for f in frames]) + CHECKSUM_OFFSET
+    col = np.minimum(col, m.shape[1]-2)
+    stored = m[rows, col] << 8 | m[rows, col+1]
+    m[rows, col] = 0
+    m[rows, col+1] = 0
+    match = (_fletcher_16_matrix(m) == stored).tolist()
+    return [a and b for a, b in zip(ok, match)]
+
+def _verify(raw):
+    if len(raw) < HEADER_LEN or raw[PAYLOAD_LEN_OFFSET] != len(raw) - HEADER_LEN:
+        return False
+    return compute_fletcher_16_sans(raw) == raw[CHECKSUM_OFFSET] << 8 | raw[CHECKSUM_OFFSET+1]
+
+# checksum as if the two checksum bytes were zero, without a zeroed copy.
+# same math as compute_fletcher_16, with the two bytes taken back out of
+# the byte sum and the base 256 number
+def compute_fletcher_16_sans(data, offset=CHECKSUM_OFFSET):
+    b0 = data[offset]
+    b1 = data[offset+1]
+    if not BIGINT:
+        # byte i of n adds b to sum_l and (n-i)*b to sum_h
+        c = fletcher_16_blocks(data)
+        k = len(data) - offset
+        return ((c >> 8) - b0*k - b1*(k-1)) % 255 << 8 | ((c & 0xff) - b0 - b1) % 255
+    s = sum(data) - b0 - b1
+    n = int.from_bytes(data, 'big') - ((b0 << 8 | b1) << 8*(len(data)-offset-2))
+    w = ((n - s) % 65025) // 255
+    return ((w + s) % 255) << 8 | (s % 255)
+
 class PacketBadCrcError(Exception):
     pass
 class PacketBadLenError(Exception):
@@ -34,7 +172,7 @@ class PacketBadLenError(Exception):
 
 class Packet:
     def __repr__(self):
-        return '<'+",".join(f"{k}={v}" for k, v in self.__dict__.items())+'>'
+        return '<'+",".join(f"{k}={bytes(v) if isinstance(v, memoryview) else v}" for k, v in self.__dict__.items())+'>'
     def __eq__(self, other) -> bool:
         for k,v in self.__dict__.items():
             if not v == other.__dict__[k]:
@@ -43,6 +181,8 @@ class Packet:
     def __init__(self, raw:bytes=b'', rssi=0, snr=0):
         self.rssi=rssi
         self.snr=snr
+        # shared decode of the received frame, if any
+        self.frame = None
         if raw:
             self.deconstruct(raw)
         else:
@@ -64,40 +204,61 @@ class Packet:
         self.aodvtype = aodvtype
         self.payload = payload
         self.payload_len = len(payload)
+        # new payload, drops the shared decode
+        self.frame = None
         self.hops = hops
         self.ttl = ttl
         return self.pack()
 
+    # per receiver copy. header fields are own, payload is shared
+    def copy(self, rssi=0, snr=0):
+        p = Packet.__new__(Packet)
+        p.__dict__.update(self.__dict__)
+        p.rssi = rssi
+        p.snr = snr
+        return p
+
+    # replace payload, drops the shared decode
+    def set_payload(self, payload:bytes):
+        self.payload = payload
+        self.payload_len = len(payload)
+        self.frame = None
+
+    # decoded payload by aodvtype, None if unknown type.
+    # shared between receivers of one frame, treat as read only
+    def message(self):
+        if self.frame is not None:
+            return self.frame.message()
+        cls = MESSAGE_TYPES.get(self.aodvtype)
+        if cls:
+            return cls(self.payload)
+        return None
+
+    # pack into the shared tx buffer, checksum in place, copy out once
     def pack(self):
-        self.header = self.send_addr + self.recv_addr + struct.pack('>BBBBHH', self.aodvtype, self.hops, self.ttl, self.payload_len, 0, 0)
-        raw = bytearray(self.header+self.payload)
-        raw[CHECKSUM_OFFSET] = 0
-        raw[CHECKSUM_OFFSET+1] = 0
-        self.checksum = compute_fletcher_16(bytes(raw))
-        struct.pack_into('>H', raw, CHECKSUM_OFFSET, self.checksum)
-        raw = bytes(raw)
-        self.header = raw[:HEADER_LEN]
+        n = HEADER_LEN + len(self.payload)
+        buf = TX_BUF if n <= len(TX_BUF) else bytearray(n)
+        HEADER_FMT.pack_into(buf, 0, self.send_addr, self.recv_addr, self.aodvtype, self.hops, self.ttl, self.payload_len, 0, 0)
+        mv = memoryview(buf)[:n]
+        mv[HEADER_LEN:] = self.payload
+        self.checksum = compute_fletcher_16(mv)
+        CHECKSUM_FMT.pack_into(buf, CHECKSUM_OFFSET, self.checksum)
+        raw = bytes(mv)
+        self.header = memoryview(raw)[:HEADER_LEN]
         return raw
 
-
+    # parse in place, header and payload are views into raw
     def deconstruct(self, raw:bytes):
-        try:
-            # split header and payload
-            self.header = raw[:HEADER_LEN]
-            self.payload = raw[HEADER_LEN:]
-            # parse
-            self.send_addr = self.header[:8]
-            self.recv_addr = self.header[8:16]
-            self.aodvtype, self.hops, self.ttl, self.payload_len, self.checksum, self.reserved = struct.unpack('>BBBBHH', self.header[16:])
-        except ValueError:
+        if len(raw) < HEADER_LEN:
             raise PacketBadLenError
-        # get raw sans checksum bytes
-        arr = bytearray(raw)
-        arr[CHECKSUM_OFFSET] = 0
-        arr[CHECKSUM_OFFSET+1] = 0
+        (self.send_addr, self.recv_addr, self.aodvtype, self.hops, self.ttl,
+         self.payload_len, self.checksum, self.reserved) = HEADER_FMT.unpack_from(raw)
+        mv = memoryview(raw)
+        self.header = mv[:HEADER_LEN]
+        self.payload = mv[HEADER_LEN:]
 
         # check packet valid
-        if not self.checksum == compute_fletcher_16(bytes(arr)):
+        if not self.checksum == compute_fletcher_16_sans(raw):
             # print('invalid crc!')
             raise PacketBadCrcError
         # check payload size valid
@@ -148,14 +309,10 @@ class RREQ:
         self.dest_only = (flags >> 1) & 1
         self.unknown = flags & 1
     def unpack(self, raw:bytes):
-        self.dest_addr = raw[:8]
-        self.orig_addr = raw[8:16]
-        self.dest_seq, self.orig_seq, self.rreq_id, self.flags = struct.unpack('>LLLB', raw[16:])
+        self.dest_addr, self.orig_addr, self.dest_seq, self.orig_seq, self.rreq_id, self.flags = RREQ_FMT.unpack_from(raw)
         self.get_flags(self.flags)
     def pack(self):
-        raw = self.dest_addr + self.orig_addr
-        raw += struct.pack('>LLLB', self.dest_seq, self.orig_seq, self.rreq_id, self.flags)
-        return raw
+        return RREQ_FMT.pack(self.dest_addr, self.orig_addr, self.dest_seq, self.orig_seq, self.rreq_id, self.flags)
 
 class RREP:
     def __repr__(self):
@@ -184,6 +341,10 @@ class RREP:
         self.req_ack = req_ack                  # bit: ack requested flag
         self.prefix_sz = prefix_sz & 0b11111    # 5 bits: if !=0, next hop ok to use by any node with same 5bit prefix as dest_addr
         self.flags = repair<<6 | req_ack<<5 | (prefix_sz & 0b11111)
+    def copy(self):
+        r = self.__class__.__new__(self.__class__)
+        r.__dict__.update(self.__dict__)
+        return r
     def set_data(self, dest_addr:bytes, orig_addr:bytes, dest_seq:int, hop_count:int, lifetime:int):
         self.dest_addr = dest_addr      # uint64_t
         self.orig_addr = orig_addr      # uint64_t
@@ -195,14 +356,10 @@ class RREP:
         self.req_ack = (flags>>5) & 1
         self.prefix_sz = flags & 0b11111
     def unpack(self, raw:bytes):
-        self.dest_addr = raw[:8]
-        self.orig_addr = raw[8:16]
-        self.dest_seq, self.flags, self.hop_count, self.lifetime = struct.unpack('>LBBL', raw[16:])
+        self.dest_addr, self.orig_addr, self.dest_seq, self.flags, self.hop_count, self.lifetime = RREP_FMT.unpack_from(raw)
         self.get_flags(self.flags)
     def pack(self):
-        raw = self.dest_addr + self.orig_addr
-        raw += struct.pack('>LBBL', self.dest_seq, self.flags, self.hop_count, self.lifetime)
-        return raw
+        return RREP_FMT.pack(self.dest_addr, self.orig_addr, self.dest_seq, self.flags, self.hop_count, self.lifetime)
 
 class RERR:
     def __repr__(self):
@@ -237,18 +394,19 @@ class RERR:
         self.no_delete = (flags>>5) & 1
         self.dest_count = flags & 0b11111
     def unpack(self, raw:bytes):
-        self.bad_addr = raw[:8]
-        self.bad_seq, self.flags = struct.unpack('>LB', raw[8:13])
+        self.bad_addr, self.bad_seq, self.flags = RERR_FMT.unpack_from(raw)
         self.get_flags(self.flags)
-        for i in range(13, 12*(self.dest_count+1),12):
-            self.addr_list.append(raw[i:i+8])
-            self.seq_list.append(int.from_bytes(raw[i+8:i+12], 'big'))
+        for i in range(RERR_FMT.size, RERR_FMT.size + RERR_DEST_FMT.size*self.dest_count, RERR_DEST_FMT.size):
+            addr, seq = RERR_DEST_FMT.unpack_from(raw, i)
+            self.addr_list.append(addr)
+            self.seq_list.append(seq)
     def pack(self):
-        raw = self.bad_addr + struct.pack('>LB', self.bad_seq, self.flags)
+        n = RERR_FMT.size + RERR_DEST_FMT.size*self.dest_count
+        raw = bytearray(n)
+        RERR_FMT.pack_into(raw, 0, self.bad_addr, self.bad_seq, self.flags)
         for i in range(self.dest_count):
-            raw += self.addr_list[i]
-            raw += struct.pack('>L', self.seq_list[i])
-        return raw
+            RERR_DEST_FMT.pack_into(raw, RERR_FMT.size + RERR_DEST_FMT.size*i, self.addr_list[i], self.seq_list[i])
+        return bytes(raw)
 
 # # PACKET: ROUTE REPLY ACKNOWLEDGMENT
 # class ACK:
@@ -281,9 +439,9 @@ class ACK:
         self.orig_seq = orig_seq
         self.data_seq = data_seq
     def unpack(self, raw:bytes):
-        self.orig_seq, self.data_seq = struct.unpack('>LL', raw)
+        self.orig_seq, self.data_seq = ACK_FMT.unpack_from(raw)
     def pack(self):
-        return struct.pack('>LL', self.orig_seq, self.data_seq)
+        return ACK_FMT.pack(self.orig_seq, self.data_seq)
 
 class DATAGRAM:
     def __repr__(self):
@@ -310,19 +468,49 @@ class DATAGRAM:
     def set_flags(self, req_ack:bool):
         self.req_ack = req_ack
     def unpack(self, raw:bytes):
-        self.dest_addr = raw[:8]
-        self.orig_addr = raw[8:16]
-        raw = raw[16:]
-        data_len = len(raw) - 4 - 1
-        self.orig_seq, flags, self.data = struct.unpack(f'>LB{data_len}s', raw)
+        self.dest_addr, self.orig_addr, self.orig_seq, flags = DATAGRAM_FMT.unpack_from(raw)
+        self.data = bytes(raw[DATAGRAM_FMT.size:])
         self.req_ack = flags & 0b1
 
     def pack(self):
-        raw = self.dest_addr + self.orig_addr
-        flags = int(self.req_ack)
-        return raw + struct.pack(f'>LB{len(self.data)}s', self.orig_seq, flags, self.data.encode('ascii'))
-
-
+        return DATAGRAM_FMT.pack(self.dest_addr, self.orig_addr, self.orig_seq, int(self.req_ack)) + self.data.encode('ascii')
+
+
+
+MESSAGE_TYPES = { AODVType.RREQ : RREQ,
+                  AODVType.RREP : RREP,
+                  AODVType.RERR : RERR,
+                  AODVType.HELLO : HELLO,
+                  AODVType.DATA : DATAGRAM,
+                  AODVType.ACK : ACK}
+
+# one transmitted frame, shared by everyone who receives it.
+# checked + decoded once on first use, each receiver gets a Packet copy
+# for the header fields it changes (hops, ttl, addrs), payload + message
+# stay shared
+class Frame:
+    def __init__(self, raw:bytes):
+        self.raw = raw
+        self._packet = None
+        self._error = None
+        self._message = None
+    def packet(self, rssi=0, snr=0):
+        if self._packet is None:
+            if self._error is None:
+                try:
+                    self._packet = Packet(self.raw)
+                    self._packet.frame = self
+                except (PacketBadCrcError, PacketBadLenError) as e:
+                    self._error = e
+            if self._error is not None:
+                raise self._error
+        return self._packet.copy(rssi, snr)
+    def message(self):
+        if self._message is None:
+            cls = MESSAGE_TYPES.get(self._packet.aodvtype)
+            if cls:
+                self._message = cls(self._packet.payload)
+        return self._message
 
 
 if __name__ == '__main__':
@@ -349,7 +537,7 @@ if __name__ == '__main__':
     p = Packet()
     r = RREP()
     r.set_flags(repair=0, req_ack=1, prefix_sz=13)
-    r.set_data(dest_addr=b'\x13'*8, orig_addr=DUMMY_ADDR, dest_seq=32, ttl_ms=300)
+    r.set_data(dest_addr=b'\x13'*8, orig_addr=DUMMY_ADDR, dest_seq=32, hop_count=3, lifetime=300)
     a = p.construct(AODVType.RREP, payload=r.pack(), send_addr=DUMMY_ADDR)
 
     pp = Packet(a)
@@ -0,0 +1,251 @@
+import time
+import multiprocessing as mp
+
+import node_config
+from node import Node as AODVNode
+from packet import Frame
+from scheduler import Scheduler
+from engine import Engine, RadioNode
+from metrics import Metrics, aggregate
+
+
+# optional multi core execution mode for the headless engine.
+#
+# aodv state is local to each node, nodes only talk through frames on the
+# medium. so workers each own a fixed block of nodes for the whole run, and
+# a tick is:
+#
+#   main:    run scheduled events, grow signals
+#   workers: apply queued ops (received frames, pings), update their nodes
+#   main:    gather emitted frames in node order, propagate, queue
+#            deliveries for the next tick
+#
+# ops carry the virtual time they happened at and run in the same order as
+# in the serial engine, so results are identical to Engine with the same
+# seed. the medium (signals, propagation, graph) stays in the main process.
+
+
+# main side stand in for a node living in a worker: position, online flag,
+# no aodv state
+class NodeProxy(RadioNode):
+    def __init__(self, addr, nickname, position, index, on_change=None):
+        self.addr = addr
+        self.nickname = nickname
+        self._position = position
+        self.index = index
+        self.online = True
+        self.on_change = on_change
+
+
+# worker process: owns nodes [first, first+len(specs))
+# config is a node_config.make() result, None for the module defaults
+def _worker(conn, first, specs, config, metrics):
+    config = config or node_config
+    clock = Scheduler()
+    nodes = [AODVNode(node_addr=addr, nickname=nick, clock=clock.time, config=config,
+                      metrics=Metrics() if metrics else None) for addr, nick in specs]
+    inboxes = [[] for _ in nodes]
+    while True:
+        msg = conn.recv()
+        cmd = msg[0]
+        if cmd == 'step':
+            _, ops, now, offline = msg
+            # decode each frame once for all receivers in this worker
+            frames = {}
+            for t, i, name, args in ops:
+                clock.now = t
+                node = nodes[i - first]
+                if name == 'on_recv':
+                    raw = args[0]
+                    f = frames.get(raw)
+                    if f is None:
+                        f = frames[raw] = Frame(raw)
+                    node.on_recv(f)
+                else:
+                    getattr(node, name)(*args)
+            clock.now = now
+            out = []
+            for j, node in enumerate(nodes):
+                if first + j in offline:
+                    continue
+                raw = node.update()
+                rx = node.pop_rx()
+                if rx:
+                    inboxes[j].append(rx)
+                while raw:
+                    out.append((first + j, bytes(raw)))
+                    raw = node.pop_tx()
+            # idle summary for skipping ticks in main
+            idle, due = True, None
+            for j, node in enumerate(nodes):
+                if first + j in offline:
+                    continue
+                if not node.idle():
+                    idle, due = False, None
+                    break
+                d = node.next_deadline()
+                if d is not None and (due is None or d < due):
+                    due = d
+            conn.send((out, idle, due))
+        elif cmd == 'call':
+            # fn(aodv node, inbox) per node, fn must be picklable
+            fn = msg[1]
+            conn.send([fn(n, b) for n, b in zip(nodes, inboxes)])
+        elif cmd == 'stop':
+            conn.close()
+            return
+
+
+class ParallelEngine(Engine):
+    def __init__(self, workers=None, **kwargs):
+        super().__init__(**kwargs)
+        self.num_workers = workers or mp.cpu_count()
+        self.procs = []
+        self.conns = []
+        self.bounds = []
+        # (time, node index, aodv method, args) waiting for the next tick
+        self.ops = []
+        self.idle = (False, None)
+
+    def add_node(self, addr, nickname, position):
+        node = NodeProxy(addr, nickname, position, len(self.nodes), self._node_changed)
+        self.nodes.append(node)
+        self.grid_dirty = True
+        self.graph.dirty = True
+        self.name2addr[nickname] = addr
+        self.addr2name[addr] = nickname
+        self.name2node[nickname] = node
+        # nodes changed, workers restart on next step
+        self.close()
+        return node
+
+    def reset_nodes(self, num_nodes=None):
+        self.close()
+        self.ops = []
+        super().reset_nodes(num_nodes)
+
+    def start(self):
+        n = len(self.nodes)
+        w = max(1, min(self.num_workers, n))
+        self.bounds = [(i * n // w, (i + 1) * n // w) for i in range(w)]
+        # modules don't pickle (spawn start method), workers import their own
+        config = None if self.config is node_config else self.config
+        for lo, hi in self.bounds:
+            a, b = mp.Pipe()
+            specs = [(node.addr, node.nickname) for node in self.nodes[lo:hi]]
+            p = mp.Process(target=_worker, args=(b, lo, specs, config, self.metrics), daemon=True)
+            p.start()
+            self.procs.append(p)
+            self.conns.append(a)
+
+    def close(self):
+        for c in self.conns:
+            c.send(('stop',))
+        for p in self.procs:
+            p.join()
+        self.procs = []
+        self.conns = []
+        self.idle = (False, None)
+
+    def _op(self, node, name, *args):
+        self.ops.append((self.scheduler.now, node.index, name, args))
+
+    def ping(self, sender:str, recver:str):
+        self._op(self.name2node[sender], 'ping', self.name2addr[recver])
+
+    def send(self, sender:str, recver:str, data:str):
+        self._op(self.name2node[sender], 'send', self.name2addr[recver], data)
+
+    def deliver(self, node, signal):
+        self._op(node, 'on_recv', signal.payload)
+
+    def update_nodes(self):
+        if not self.conns:
+            self.start()
+        offline = {n.index for n in self.nodes if not n.online}
+        # split ops by owner, order within each worker is kept
+        ops = [[] for _ in self.conns]
+        for op in self.ops:
+            for w, (lo, hi) in enumerate(self.bounds):
+                if lo <= op[1] < hi:
+                    ops[w].append(op)
+                    break
+        self.ops = []
+        for c, o in zip(self.conns, ops):
+            c.send(('step', o, self.scheduler.now, offline))
+        # workers hold contiguous blocks, so this is node order
+        idle, due = True, None
+        for c in self.conns:
+            out, i, d = c.recv()
+            for index, raw in out:
+                self.emit_signal(self.nodes[index], raw)
+            if not i:
+                idle = False
+            elif d is not None and (due is None or d < due):
+                due = d
+        self.idle = (idle, due if idle else None)
+
+    def nodes_idle(self):
+        if self.ops or not self.conns:
+            return False, None
+        return self.idle
+
+    # fn(aodv node, inbox) for every node, in node order
+    def call(self, fn):
+        if not self.conns:
+            self.start()
+        out = []
+        for c in self.conns:
+            c.send(('call', fn))
+        for c in self.conns:
+            out.extend(c.recv())
+        return out
+
+
+    def snapshot(self):
+        return aggregate(self.call(_snapshot))
+
+
+def _snapshot(node, inbox):
+    return node.metrics.snapshot()
+
+# for the determinism check
+def _summary(node, inbox):
+    routes = sorted((a, r.next_hop, r.seq_num, r.hops) for a, r in node.routing_table.items())
+    return (node.seq_num, node.rx_processed, node.rx_dropped, len(inbox), routes)
+
+def _trace(engine, seconds):
+    log = []
+    engine.on_emit.append(lambda e, node, s: log.append((e.ticks, node.addr, bytes(s.payload))))
+    names = engine.node_names()
+    engine.ping(names[0], names[1])
+    engine.ping(names[2], names[-1])
+    engine.at(seconds / 2, lambda: engine.ping(names[3], names[-2]))
+    start = time.time()
+    engine.run_for(seconds)
+    return log, time.time() - start
+
+
+if __name__ == '__main__':
+    import sys
+
+    num_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else mp.cpu_count()
+
+    e = Engine(seed=0)
+    e.reset_nodes(num_nodes=num_nodes)
+    serial, t_serial = _trace(e, seconds)
+    serial_state = [_summary(n.aodv, n.inbox) for n in e.nodes]
+
+    p = ParallelEngine(workers=workers, seed=0)
+    p.reset_nodes(num_nodes=num_nodes)
+    par, t_par = _trace(p, seconds)
+    par_state = p.call(_summary)
+    p.close()
+
+    same = serial == par and serial_state == par_state
+    print(f'{num_nodes} nodes, {seconds}s virtual, {len(serial)} frames, {mp.cpu_count()} cpus')
+    print(f'serial   {t_serial:.2f}s')
+    print(f'parallel {t_par:.2f}s with {len(p.bounds)} workers ({t_serial/t_par:.2f}x)')
+    print('identical to serial' if same else 'MISMATCH with serial')
@@ -0,0 +1,209 @@
+import mmap
+import sys
+from collections import OrderedDict
+
+import node_config
+from capture import MAGIC, RECORD, TX, RX
+from metrics import Histogram
+from packet import Packet, AODVType, PacketBadCrcError, PacketBadLenError
+
+
+# offline analysis of a capture file (see capture.py), no simulation rerun.
+#
+#   r = Replay()
+#   r.run('run.cap')
+#   r.summary()
+#
+# the file is memory mapped and read one record at a time, receptions look
+# their frame up in the mapping by offset. memory depends on the number of
+# nodes and of floods in flight, not on the length of the capture.
+#
+# routing tables are inferred from what each node received, using the same
+# rules as node.py. frames a node dropped (full inbox, offline) still count,
+# so they are an upper bound of what the nodes really held.
+
+# decoded tx frames kept for their receptions
+DECODE_CACHE = 256
+
+FLOOD_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+
+# (offset, kind, time, addr, frame bytes) per record, lazily.
+# for RX records the frame is the one of the TX record they reference
+def records(mm):
+    if mm[:len(MAGIC)] != MAGIC:
+        raise ValueError('not a capture file')
+    offset = len(MAGIC)
+    end = len(mm)
+    size = RECORD.size
+    unpack = RECORD.unpack_from
+    while offset + size <= end:
+        kind, t, addr, ref, length = unpack(mm, offset)
+        if kind == RX:
+            _, _, _, _, n = unpack(mm, ref)
+            raw = mm[ref+size:ref+size+n]
+        else:
+            raw = mm[offset+size:offset+size+length]
+        yield offset, kind, t, addr, ref, raw
+        offset += size + length
+
+
+class Replay:
+    def __init__(self, config=node_config):
+        self.config = config
+        # addr: {dest: (next_hop, seq, hops, expires)}
+        self.tables = {}
+        self.route_changes = 0
+        # (orig, dest): rreq send time of a discovery waiting for its rrep
+        self.pending = {}
+        self.discovery = Histogram()
+        # (orig, rreq_id): [first seen, last seen, transmissions, receptions]
+        self.floods = OrderedDict()
+        self.flood_tx = Histogram(FLOOD_BUCKETS)
+        self.flood_rx = Histogram(FLOOD_BUCKETS)
+        self.frames = 0
+        self.receptions = 0
+        self.bad = 0
+        self.end = 0
+        # optional fn(time, node, dest, next_hop, seq, hops) per route change
+        self.on_route = None
+        self._decoded = OrderedDict()
+
+    def run(self, path):
+        with open(path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for offset, kind, t, addr, ref, raw in records(mm):
+                    p = self._decode(offset if kind == TX else ref, raw)
+                    self.end = t
+                    if p is None:
+                        self.bad += 1
+                    elif kind == TX:
+                        self.frames += 1
+                        self._tx(t, addr, p)
+                    else:
+                        self.receptions += 1
+                        self._rx(t, addr, p)
+                    self._close_floods(t)
+        self._close_floods(None)
+        return self
+
+    # one decode per frame, shared by its receptions
+    def _decode(self, ref, raw):
+        d = self._decoded
+        p = d.get(ref)
+        if p is not None or ref in d:
+            return p
+        try:
+            p = Packet(raw)
+        except (PacketBadCrcError, PacketBadLenError):
+            p = None
+        d[ref] = p
+        if len(d) > DECODE_CACHE:
+            d.popitem(last=False)
+        return p
+
+    def _flood(self, t, rreq):
+        key = (rreq.orig_addr, rreq.rreq_id)
+        f = self.floods.get(key)
+        if f is None:
+            f = self.floods[key] = [t, t, 0, 0]
+        else:
+            f[1] = t
+            self.floods.move_to_end(key)
+        return f
+
+    # floods quiet for PATH_DISCOVERY_TIME are over, None closes all
+    def _close_floods(self, t):
+        floods = self.floods
+        while floods:
+            key, f = next(iter(floods.items()))
+            if t is not None and t - f[1] < self.config.PATH_DISCOVERY_TIME:
+                return
+            del floods[key]
+            self.flood_tx.observe(f[2])
+            self.flood_rx.observe(f[3])
+
+    def _tx(self, t, sender, p):
+        if p.aodvtype == AODVType.RREQ:
+            rreq = p.message()
+            self._flood(t, rreq)[2] += 1
+            if rreq.orig_addr == sender:
+                self.pending.setdefault((sender, rreq.dest_addr), t)
+
+    # same tables as node.py builds on reception
+    def _rx(self, t, addr, p):
+        hops = p.hops + 1
+        msg = p.message()
+        if p.aodvtype == AODVType.RREQ:
+            self._flood(t, msg)[3] += 1
+            if msg.orig_addr != addr:
+                life = 2*self.config.NET_TRAVERSAL_TIME - 2*hops*self.config.NODE_TRAVERSAL_TIME
+                self._route(t, addr, msg.orig_addr, p.send_addr, msg.orig_seq, hops, life)
+        elif p.aodvtype == AODVType.RREP:
+            self._route(t, addr, msg.dest_addr, p.send_addr, msg.dest_seq, msg.hop_count + 1, msg.lifetime)
+            if p.recv_addr == addr and msg.orig_addr == addr:
+                start = self.pending.pop((addr, msg.dest_addr), None)
+                if start is not None:
+                    self.discovery.observe(t - start)
+        elif p.aodvtype == AODVType.HELLO:
+            self._route(t, addr, msg.dest_addr, msg.dest_addr, msg.dest_seq, 1, self.config.ACTIVE_ROUTE_TIMEOUT)
+        elif p.aodvtype == AODVType.DATA:
+            self._route(t, addr, msg.orig_addr, p.send_addr, msg.orig_seq, hops, self.config.ACTIVE_ROUTE_TIMEOUT)
+        self._route(t, addr, p.send_addr, p.send_addr, 0, 1, self.config.ACTIVE_ROUTE_TIMEOUT)
+
+    # RoutingTable.add_update rules, expired routes are replaced
+    def _route(self, t, addr, dest, next_hop, seq, hops, lifetime):
+        if dest == addr:
+            return
+        table = self.tables.get(addr)
+        if table is None:
+            table = self.tables[addr] = {}
+        old = table.get(dest)
+        if old and old[3] > t:
+            if not ((seq - old[1] < 0) or (seq == old[1] and hops < old[2])):
+                return
+        table[dest] = (next_hop, seq, hops, t + max(0, lifetime))
+        self.route_changes += 1
+        if self.on_route:
+            self.on_route(t, addr, dest, next_hop, seq, hops)
+
+    # routes of addr still live at time t, default end of capture
+    def table(self, addr, t=None):
+        t = self.end if t is None else t
+        return { d : r for d, r in self.tables.get(addr, {}).items() if r[3] > t }
+
+    def summary(self):
+        return { 'frames'         : self.frames,
+                 'receptions'     : self.receptions,
+                 'bad_frames'     : self.bad,
+                 'duration'       : self.end,
+                 'route_changes'  : self.route_changes,
+                 'routes_live'    : sum(len(self.table(a)) for a in self.tables),
+                 'discoveries'    : self.discovery.snapshot(),
+                 'unanswered'     : len(self.pending),
+                 'flood_tx'       : self.flood_tx.snapshot(),
+                 'flood_rx'       : self.flood_rx.snapshot() }
+
+
+if __name__ == '__main__':
+    import time
+    if len(sys.argv) < 2:
+        sys.exit('usage: python3 replay.py in.cap [--routes]')
+    r = Replay()
+    if '--routes' in sys.argv[2:]:
+        r.on_route = lambda t, a, d, n, s, h: print(f'{t:10.3f} {a.hex()} -> {d.hex()} via {n.hex()} seq {s} hops {h}')
+    start = time.time()
+    r.run(sys.argv[1])
+    s = r.summary()
+    print(f'{s["frames"]} frames, {s["receptions"]} receptions, {s["bad_frames"]} bad, '
+          f'{s["duration"]:.1f}s virtual, replayed in {time.time()-start:.2f}s')
+    print(f'route changes {s["route_changes"]}, live routes at end {s["routes_live"]}')
+    d = s['discoveries']
+    if d['n']:
+        print(f'discoveries {d["n"]} mean {d["mean"]:.3f}s max {d["max"]:.3f}s, {s["unanswered"]} unanswered')
+    else:
+        print(f'no discoveries completed, {s["unanswered"]} unanswered')
+    for k in ('flood_tx', 'flood_rx'):
+        h = s[k]
+        if h['n']:
+            print(f'{k} {h["n"]} floods mean {h["mean"]:.1f} max {h["max"]}')
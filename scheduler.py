@@ -0,0 +1,59 @@
+import time
+
+try:
+    import heapq
+except:
+    import uheapq as heapq
+
+
+# wall clock, default clock for nodes
+def wall_clock():
+    return time.time()
+
+# high resolution timer for cpu budgets, never virtual
+try:
+    perf_clock = time.perf_counter
+except AttributeError:
+    perf_clock = time.time
+
+
+# discrete event scheduler with virtual time
+# events are callables run in (time, insertion) order
+# pass scheduler.time as the clock of nodes so their timers run on virtual time
+class Scheduler:
+    def __init__(self, start=0.0):
+        self.now = start
+        self.queue = []
+        self.seq = 0
+
+    def time(self):
+        return self.now
+
+    def __len__(self):
+        return len(self.queue)
+
+    # run event at absolute virtual time t
+    def at(self, t, event):
+        if t < self.now:
+            t = self.now
+        self.seq += 1
+        heapq.heappush(self.queue, (t, self.seq, event))
+
+    # run event delay seconds from now
+    def after(self, delay, event):
+        self.at(self.now + delay, event)
+
+    # time of next event, None if empty
+    def peek(self):
+        if self.queue:
+            return self.queue[0][0]
+        return None
+
+    # run all events due up to t, then move clock to t
+    def run_until(self, t):
+        while self.queue and self.queue[0][0] <= t:
+            when, _, event = heapq.heappop(self.queue)
+            self.now = when
+            event()
+        if t > self.now:
+            self.now = t
@@ -109,3 +109,13 @@ SIM_DIM = (0, 0, SIM_WIDTH, SIM_HEIGHT)
 GUI_DIM = (0, SIM_HEIGHT, GUI_WIDTH, GUI_HEIGHT)
 VIEW_DIM = [(SIM_WIDTH, 0, VIEW_WIDTH, VIEW_HEIGHT),
             (SIM_WIDTH+VIEW_WIDTH, 0, VIEW_WIDTH, VIEW_HEIGHT)]
+
+# spatial index cell size, px
+GRID_CELL_SIZE = 50
+
+# propagation index: 'grid', or 'vector' (numpy, falls back to grid)
+MEDIUM = 'grid'
+# vector: max signal x node pairs per broadcast
+VECTOR_CHUNK = 1 << 20
+# find receivers through the connectivity graph cache when possible
+USE_GRAPH = True
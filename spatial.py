@@ -0,0 +1,126 @@
+import sim_config as cfg
+
+# optional, vectorized propagation
+try:
+    import numpy as np
+except:
+    np = None
+
+
+# uniform grid over node positions
+# rebuild when nodes move, then query rings around a signal
+class Grid:
+    def __init__(self, cell_size=cfg.GRID_CELL_SIZE):
+        self.cell = cell_size
+        self.cells = {}
+
+    def _key(self, position):
+        return (int(position[0] // self.cell), int(position[1] // self.cell))
+
+    def rebuild(self, nodes):
+        self.cells = {}
+        for n in nodes:
+            k = self._key(n.position)
+            if k in self.cells:
+                self.cells[k].append(n)
+            else:
+                self.cells[k] = [n]
+
+    # nodes with inner <= distance < outer from position
+    # only visits cells overlapping the ring
+    def ring(self, position, inner, outer):
+        x, y = position
+        c = self.cell
+        in2 = inner * inner
+        out2 = outer * outer
+        cells = self.cells
+        cx0, cy0 = self._key((x - outer, y - outer))
+        cx1, cy1 = self._key((x + outer, y + outer))
+        for cx in range(cx0, cx1 + 1):
+            lo = cx * c
+            hi = lo + c
+            dx_near = lo - x if x < lo else (x - hi if x > hi else 0)
+            dx_far = max(x - lo, hi - x)
+            for cy in range(cy0, cy1 + 1):
+                bucket = cells.get((cx, cy))
+                if not bucket:
+                    continue
+                lo_y = cy * c
+                hi_y = lo_y + c
+                dy_near = lo_y - y if y < lo_y else (y - hi_y if y > hi_y else 0)
+                # cell entirely outside the ring
+                if dx_near*dx_near + dy_near*dy_near >= out2:
+                    continue
+                # cell entirely inside already covered disk
+                dy_far = max(y - lo_y, hi_y - y)
+                if dx_far*dx_far + dy_far*dy_far < in2:
+                    continue
+                for n in bucket:
+                    nx, ny = n.position
+                    d2 = (nx-x)*(nx-x) + (ny-y)*(ny-y)
+                    if in2 <= d2 < out2:
+                        yield n
+
+    # (signal, node) pairs newly reached since signal.covered
+    def reached(self, signals):
+        for signal in signals:
+            for node in self.ring(signal.position, signal.covered, signal.radius):
+                yield signal, node
+
+
+# all node positions in one array, all signals tested against all nodes
+# with one broadcast distance computation per tick. wins over the grid
+# when thousands of signals are in flight, ie a network wide rreq flood.
+# skips offline nodes and the sender itself
+class Vector:
+    def __init__(self, chunk=cfg.VECTOR_CHUNK):
+        # max signal x node pairs per broadcast, bounds memory
+        self.chunk = chunk
+        self.nodes = []
+        self.x = np.zeros(0)
+        self.y = np.zeros(0)
+        self.online = np.zeros(0, dtype=bool)
+        self.addr2idx = {}
+
+    def rebuild(self, nodes):
+        self.nodes = list(nodes)
+        self.x = np.array([n.position[0] for n in nodes], dtype=float)
+        self.y = np.array([n.position[1] for n in nodes], dtype=float)
+        self.online = np.array([n.online for n in nodes], dtype=bool)
+        self.addr2idx = {n.addr : i for i, n in enumerate(nodes)}
+
+    def reached(self, signals):
+        n = len(self.nodes)
+        if not signals or not n:
+            return
+        ox = np.array([s.position[0] for s in signals], dtype=float)
+        oy = np.array([s.position[1] for s in signals], dtype=float)
+        inner2 = np.array([s.covered for s in signals], dtype=float) ** 2
+        outer2 = np.array([s.radius for s in signals], dtype=float) ** 2
+        # sender index per signal, -1 if not a known node
+        src = np.array([self.addr2idx.get(s.src_addr, -1) for s in signals])
+        rows = max(1, self.chunk // n)
+        for lo in range(0, len(signals), rows):
+            hi = min(lo + rows, len(signals))
+            dx = self.x[None, :] - ox[lo:hi, None]
+            dy = self.y[None, :] - oy[lo:hi, None]
+            d2 = dx * dx
+            d2 += dy * dy
+            mask = d2 < outer2[lo:hi, None]
+            mask &= d2 >= inner2[lo:hi, None]
+            mask &= self.online[None, :]
+            # sender doesn't hear itself
+            s = src[lo:hi]
+            k = np.nonzero(s >= 0)[0]
+            mask[k, s[k]] = False
+            # row major: signal order, then node order
+            for si, ni in zip(*np.nonzero(mask)):
+                yield signals[lo + si], self.nodes[ni]
+
+
+# propagation index for the engine: 'vector' needs numpy, else grid
+def make_index(kind=None):
+    kind = kind or cfg.MEDIUM
+    if kind == 'vector' and np is not None:
+        return Vector()
+    return Grid()
@@ -0,0 +1,169 @@
+import csv
+import sys
+import time
+from itertools import product
+from multiprocessing import Pool, cpu_count
+from random import Random
+
+import node_config
+from engine import Engine
+from packet import AODVType, PacketBadCrcError, PacketBadLenError
+
+
+# batch parameter sweep: every combination of the given values and seeds
+# runs headless in a process pool, one results row per run.
+#
+#   python3 sweep.py ACTIVE_ROUTE_TIMEOUT=30,60 range=120,180 nodes=50,100 seed=0,1,2
+#
+# UPPERCASE keys are node_config settings (per run, via node_config.make),
+# lowercase keys are scenario settings, see DEFAULTS
+
+
+DEFAULTS = { 'nodes'   : 50,
+             'range'   : 180,
+             'speed'   : 5,
+             'seed'    : 0,
+             'flows'   : 5,       # random src/dest pairs, each sends one datagram
+             'seconds' : 30,      # virtual time per run
+             'medium'  : 'grid' }
+
+COLUMNS = ['discovered', 'discovery_mean', 'discovery_max', 'delivered', 'delivery_ratio',
+           'delivery_mean', 'control_frames', 'control_bytes', 'data_frames',
+           'rreq_ratelimited', 'rreq_ratelimit_drop', 'wall']
+
+
+# decoded datagram of a data signal, None if not one
+def _datagram(signal):
+    if signal.aodvtype != AODVType.DATA:
+        return None
+    try:
+        signal.frame.packet()
+    except (PacketBadCrcError, PacketBadLenError):
+        return None
+    return signal.frame.message()
+
+
+# one headless run, returns params + results
+def run(params):
+    p = dict(DEFAULTS)
+    p.update(params)
+    config = node_config.make(**{k : v for k, v in p.items() if k.isupper()})
+
+    e = Engine(seed=p['seed'], medium=p['medium'], config=config)
+    e.settings.range = p['range']
+    e.settings.speed = p['speed']
+    e.reset_nodes(num_nodes=p['nodes'])
+
+    # flows, picked from their own stream so they don't shift node layout
+    rand = Random(p['seed'])
+    names = e.node_names()
+    flows = {}
+    for i in range(p['flows']):
+        src, dest = rand.sample(names, 2)
+        flows[(e.name2addr[src], e.name2addr[dest])] = {}
+        e.send(src, dest, f'flow {i}')
+
+    stats = { 'control_frames' : 0, 'control_bytes' : 0, 'data_frames' : 0 }
+
+    def emitted(engine, node, signal):
+        d = _datagram(signal)
+        if d is None:
+            stats['control_frames'] += 1
+            stats['control_bytes'] += len(signal.payload)
+            return
+        stats['data_frames'] += 1
+        # source sending its data = route discovered
+        f = flows.get((d.orig_addr, d.dest_addr))
+        if f is not None and node.addr == d.orig_addr and not 'discovered' in f:
+            f['discovered'] = engine.now()
+
+    def delivered(engine, node, signal):
+        d = _datagram(signal)
+        if d is not None and node.addr == d.dest_addr:
+            f = flows.get((d.orig_addr, d.dest_addr))
+            if f is not None and not 'delivered' in f:
+                f['delivered'] = engine.now()
+
+    e.on_emit.append(emitted)
+    e.on_deliver.append(delivered)
+
+    start = time.time()
+    e.run_for(p['seconds'])
+
+    found = [f['discovered'] for f in flows.values() if 'discovered' in f]
+    got = [f['delivered'] for f in flows.values() if 'delivered' in f]
+    counters = e.snapshot()
+    row = dict(p)
+    row.update(stats)
+    row['discovered'] = len(found)
+    row['discovery_mean'] = round(sum(found) / len(found), 3) if found else ''
+    row['discovery_max'] = round(max(found), 3) if found else ''
+    row['delivered'] = len(got)
+    row['delivery_ratio'] = round(len(got) / len(flows), 3) if flows else ''
+    # flows all start at 0, so delivery time is latency
+    row['delivery_mean'] = round(sum(got) / len(got), 3) if got else ''
+    for k in ('rreq_ratelimited', 'rreq_ratelimit_drop'):
+        row[k] = counters.get(k, 0)
+    row['wall'] = round(time.time() - start, 2)
+    return row
+
+
+# 'a=1,2' -> ('a', [1, 2]), numbers and True/False parsed
+def _parse(arg):
+    k, v = arg.split('=', 1)
+    vals = []
+    for x in v.split(','):
+        if x in ('True', 'False'):
+            vals.append(x == 'True')
+            continue
+        for t in (int, float):
+            try:
+                x = t(x)
+                break
+            except ValueError:
+                pass
+        vals.append(x)
+    return k, vals
+
+def grid(axes):
+    keys = list(axes.keys())
+    return [dict(zip(keys, vals)) for vals in product(*axes.values())]
+
+def sweep(axes, workers=None, out=None):
+    runs = grid(axes)
+    with Pool(workers or cpu_count()) as pool:
+        rows = pool.map(run, runs)
+    keys = list(axes.keys())
+    header = keys + [k for k in DEFAULTS if not k in keys] + COLUMNS
+    if out:
+        with open(out, 'w', newline='') as f:
+            w = csv.DictWriter(f, fieldnames=header, extrasaction='ignore')
+            w.writeheader()
+            w.writerows(rows)
+    return header, rows
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    out = 'sweep.csv'
+    workers = None
+    axes = {}
+    for a in args:
+        if a.startswith('--out='):
+            out = a[len('--out='):]
+        elif a.startswith('--workers='):
+            workers = int(a[len('--workers='):])
+        else:
+            k, vals = _parse(a)
+            if not k in DEFAULTS and not hasattr(node_config, k):
+                sys.exit(f'unknown parameter: {k}')
+            axes[k] = vals
+
+    start = time.time()
+    header, rows = sweep(axes, workers, out)
+    cols = list(axes.keys()) + COLUMNS
+    widths = [max(16, len(c) + 2) for c in cols]
+    print(''.join(f'{c:>{w}}' for c, w in zip(cols, widths)))
+    for r in rows:
+        print(''.join(f'{str(r[c]):>{w}}' for c, w in zip(cols, widths)))
+    print(f'{len(rows)} runs in {time.time()-start:.1f}s, written to {out}')